@@ -1,90 +1,96 @@
 import streamlit as st
-from segmentation import get_menu, split_menu, get_portraits
-from PIL import Image, ImageDraw
-from mmlab_ocr import run_ocr, parse_ocr_overall_results, parse_ocr_boss_specific_results
-from matcher import match_portrait
+from segmentation import canonicalize, get_menu, split_menu, get_portraits
+from frame import Frame
+from PIL import Image
+from mmlab_ocr import run_ocr, run_ocr_rows
+from reverify import reverify_rows, DEFAULT_VARIANTS, BOSS_LEVEL_RANGE
+from portrait_cache import PortraitMatchCache
+from results_store import ResultsStore
+from pipeline import RowPipeline
+from video_ingest import iter_new_rows
+from artifacts import ArtifactRecorder
 import pandas as pd
-import numpy as np
 import re
 import pickle
 import os
+import tempfile
 
+# screen recordings of scrolling through the Union Log
+VIDEO_TYPES = ["mp4", "mov", "webm"]
+# results table columns of the per-field confidences
+CONFIDENCE_COLUMNS = {"damage": "Damage Confidence", "name": "Name Confidence", "boss_name": "Boss Name Confidence",
+                      "unit_level": "Unit Level Confidence", "boss_level": "Boss Level Confidence"}
 
-def mode_0(image):
-    # split the menu
-    menu_images = split_menu(menu, mode='Boss Specific')
-    if display_intermediate_images:
-        # display the menu items
-        for i, menu_image in enumerate(menu_images):
-            st.image(menu_image, caption=f"Menu Item {i}", use_column_width=True)
-
+@st.cache_resource
+def load_portrait_cache():
     # read in the template images
     current_dir = os.path.dirname(os.path.abspath(__file__))
     # go up one directory and into the assets folder
     template_images_filepath = os.path.join(current_dir, '..', 'assets', 'nikke_images.pkl')
     with open(template_images_filepath, 'rb') as f:
         template_images = pickle.load(f)
+    cache_filepath = os.path.join(current_dir, '..', 'assets', 'portrait_match_cache.pkl')
+    return PortraitMatchCache(template_images, cache_filepath=cache_filepath)
+
+def mode_0(menu, menu_images=None):
+    # split the menu, unless the rows were already picked out of a video frame
+    if menu_images is None:
+        menu_images = split_menu(menu, mode='Boss Specific')
+
+    # the template images, behind a perceptual hash memo of previous matches
+    portrait_cache = load_portrait_cache()
 
     # perform OCR on the menu items
+    if single_detection_pass:
+        # detect text once on the whole menu and assign the detections to rows by their boxes
+        ocr_predictions = run_ocr_rows(menu.bgr, [menu_image.box for menu_image in menu_images], det_short_side=det_short_side)
+
+    # TODO : currently hard coded to skip the boss portrait, probably not an actual needed feature
+    skip_first_portrait = True
+
+    # the two stages run concurrently in worker threads, so they can't call streamlit
+    def ocr_stage(i, menu_image):
+        if single_detection_pass:
+            return ocr_predictions[i]
+        # BGR view of the row, shared with the rest of the screenshot
+        return run_ocr(menu_image.bgr, det_short_side=det_short_side)['predictions'][0]
+
+    def portrait_stage(i, menu_image):
+        portraits = get_portraits(menu_image)
+        if len(portraits) != 6:
+            return portraits, None
+        portrait_IDs = []
+        for j, portrait in enumerate(portraits):
+            if skip_first_portrait and j == 0:
+                continue
+            portrait_ID, _ = portrait_cache.match(portrait)
+            portrait_IDs.append(portrait_ID)
+        return portraits, portrait_IDs
+
+    row_pipeline = RowPipeline(ocr_stage, portrait_stage, num_workers=num_workers)
+    row_results = row_pipeline.run(menu_images)
+
+    # parse the rows and recognize the doubtful texts of all rows again in one batch
+    ocr_fields, confidences, ocr_predictions, reverify_stats = reverify_rows(
+        'Boss Specific', [menu_image.bgr for menu_image in menu_images], [ocr_prediction for ocr_prediction, _ in row_results],
+        variants=reverify_variants, boss_level_range=boss_level_range)
+
     commander_names = []
     commander_damages = []
     team_composition = []
     unit_levels = []
     boss_levels = []
-    for i, menu_image in enumerate(menu_images):
-        bgr_menu_image = np.array(menu_image)
-        bgr_menu_image = bgr_menu_image[:, :, ::-1].copy()
-        # get the height and width of the image
-        width, height = menu_image.size
-        
-        ocr_result = run_ocr(bgr_menu_image)
-        rec_texts = ocr_result['predictions'][0]['rec_texts']
-        det_polygons = ocr_result['predictions'][0]['det_polygons']
-        commander_damage, commander_name, unit_level, boss_level = parse_ocr_boss_specific_results(rec_texts, det_polygons, width, height)
-
-        if display_intermediate_images:
-            # draw the bounding boxes but don't modify the original image
-            menu_image_display = menu_image.copy()
-            draw = ImageDraw.Draw(menu_image_display)
-            for polygon in det_polygons:
-                draw.polygon(polygon, outline="red", width=3)
-            # display the image with bounding boxes
-            st.markdown(f"Menu Item {i} with Text Detections")
-            st.image(menu_image_display, caption=f"Menu Item {i}", use_column_width=True)
+    for i, (menu_image, (_, (portraits, portrait_IDs))) in enumerate(zip(menu_images, row_results)):
+        commander_damage, commander_name, unit_level, boss_level = ocr_fields[i]
+        det_polygons = ocr_predictions[i]['det_polygons']
 
-        portraits = get_portraits(menu_image)
-        if len(portraits) != 6:
+        portrait_error_flag = portrait_IDs is None
+        if portrait_error_flag:
             st.markdown(f"For Menu Item {i+1}, found {len(portraits)} portraits instead of 6. Only reporting OCR results.")
-            portrait_error_flag = True
-        else:
-            portrait_error_flag = False
 
-        # TODO : currently hard coded to skip the boss portrait, probably not an actual needed feature
-        skip_first_portrait = True
-        if portrait_error_flag is False:
-            portrait_IDs = []
-            template_images_folderpath = 'nikke_database'
-            for i, portrait in enumerate(portraits):
-                if skip_first_portrait and i == 0:
-                    continue
-                portrait_ID = match_portrait(portrait, template_images)
-                portrait_IDs.append(portrait_ID)
-
-        if display_intermediate_images:
-            # display the portraits
-            st.markdown(f"Menu Item {i} Portraits")
-            for j, portrait in enumerate(portraits):
-                if skip_first_portrait and j == 0:
-                    continue
-                st.image(portrait, caption=f"Portrait {j}", use_column_width=True)
-                if portrait_error_flag is False:
-                    if skip_first_portrait:
-                        # off by 1 because we skipped the first portrait
-                        st.markdown(f"**Portrait {j} ID: {portrait_IDs[j-1]}**")
-                    else:
-                        st.markdown(f"**Portrait {j} ID: {portrait_IDs[j]}**")
-                else:
-                    st.markdown(f"**Portrait {j} ID: N/A**")
+        if artifacts is not None:
+            # only the boxes are kept, thumbnails are rendered for the rows that get inspected
+            artifacts.record_row(f"Menu Item {len(artifacts.rows)}", menu_image, det_polygons, portraits, portrait_IDs)
 
         # collect the results
         commander_names.append(commander_name)
@@ -96,50 +102,85 @@ def mode_0(image):
         else:
             team_composition.append(['N/A'])
 
-    return commander_names, commander_damages, team_composition, boss_levels, unit_levels
-
-def mode_1(image):
-    # split the menu
-    mode = 'Overall'
-    menu_images = split_menu(menu, mode)
-    if display_intermediate_images:
-        # display the menu items
-        for i, menu_image in enumerate(menu_images):
-            st.image(menu_image, caption=f"Menu Item {i}", use_column_width=True)
-    
+    # keep the memo across restarts
+    portrait_cache.save()
+
+    if artifacts is not None:
+        artifacts.record_table("Portrait Match Cache", pd.DataFrame([portrait_cache.metrics()]))
+        # time rows spent waiting for each stage and time spent in it
+        artifacts.record_table("Pipeline Stage Timings (seconds)", pd.DataFrame(row_pipeline.stats).T)
+        artifacts.record_table("Re-recognition", pd.DataFrame([reverify_stats]))
+
+    return commander_names, commander_damages, team_composition, boss_levels, unit_levels, confidences
+
+def mode_1(menu, menu_images=None):
+    # split the menu, unless the rows were already picked out of a video frame
+    if menu_images is None:
+        menu_images = split_menu(menu, mode='Overall')
+
     # perform OCR on the menu items
+    if single_detection_pass:
+        # detect text once on the whole menu and assign the detections to rows by their boxes
+        ocr_predictions = run_ocr_rows(menu.bgr, [menu_image.box for menu_image in menu_images], det_short_side=det_short_side)
+    else:
+        # BGR views of the rows, shared with the rest of the screenshot
+        ocr_predictions = [run_ocr(menu_image.bgr, det_short_side=det_short_side)['predictions'][0] for menu_image in menu_images]
+
+    # parse the rows and recognize the doubtful texts of all rows again in one batch
+    ocr_fields, confidences, ocr_predictions, reverify_stats = reverify_rows(
+        'Overall', [menu_image.bgr for menu_image in menu_images], ocr_predictions,
+        variants=reverify_variants, boss_level_range=boss_level_range)
+
     commander_names = []
     commander_damages = []
     boss_names = []
     boss_levels = []
     for i, menu_image in enumerate(menu_images):
-        bgr_menu_image = np.array(menu_image)
-        bgr_menu_image = bgr_menu_image[:, :, ::-1].copy()
-            # get the height and width of the image
-        width, height = menu_image.size
-        
-        ocr_result = run_ocr(bgr_menu_image)
-        rec_texts = ocr_result['predictions'][0]['rec_texts']
-        det_polygons = ocr_result['predictions'][0]['det_polygons']
-        commander_damage, commander_name, boss_name, boss_level = parse_ocr_overall_results(rec_texts, det_polygons, width, height)
-
-        if display_intermediate_images:
-            # draw the bounding boxes but don't modify the original image
-            menu_image_display = menu_image.copy()
-            draw = ImageDraw.Draw(menu_image_display)
-            for polygon in det_polygons:
-                draw.polygon(polygon, outline="red", width=3)
-            # display the image with bounding boxes
-            st.markdown(f"Menu Item {i} with Text Detections")
-            st.image(menu_image_display, caption=f"Menu Item {i}", use_column_width=True)
-        
+        commander_damage, commander_name, boss_name, boss_level = ocr_fields[i]
+        det_polygons = ocr_predictions[i]['det_polygons']
+
+        if artifacts is not None:
+            artifacts.record_row(f"Menu Item {len(artifacts.rows)}", menu_image, det_polygons)
+
         # collect the results
         commander_names.append(commander_name)
         commander_damages.append(commander_damage)
         boss_names.append(boss_name)
         boss_levels.append(boss_level)
 
-    return commander_names, commander_damages, boss_names, boss_levels
+    if artifacts is not None:
+        artifacts.record_table("Re-recognition", pd.DataFrame([reverify_stats]))
+
+    return commander_names, commander_damages, boss_names, boss_levels, confidences
+
+def extract_results(menu, menu_images=None):
+    if mode == "Boss Specific":
+        commander_names, commander_damage, team_composition, boss_levels, unit_levels, confidences = mode_0(menu, menu_images)
+        results = pd.DataFrame({"Commander Name": commander_names, "Commander Damage": commander_damage,
+                                "Team Composition": team_composition, "Boss Level": boss_levels, "Unit Levels": unit_levels})
+    else:
+        commander_names, commander_damage, boss_name, boss_level, confidences = mode_1(menu, menu_images)
+        results = pd.DataFrame({"Commander Name": commander_names, "Commander Damage": commander_damage,
+                                "Boss Name": boss_name, "Boss Level": boss_level})
+    # one confidence column per field, 0 when the field failed validation
+    confidences = pd.DataFrame(confidences, index=results.index).rename(columns=CONFIDENCE_COLUMNS)
+    return pd.concat([results, confidences], axis=1)
+
+def show_intermediate_images(artifacts):
+    st.markdown("## Intermediate Images")
+    for image, thumbnail in zip(artifacts.images, artifacts.render_images()):
+        st.image(thumbnail, caption=image['label'], use_column_width=True)
+    # rows are only rendered once they are picked, as downscaled JPEGs
+    selected_rows = st.multiselect("Menu Items to Inspect", options=list(range(len(artifacts.rows))),
+                                   format_func=lambda i: artifacts.rows[i]['label'])
+    for i, thumbnail in zip(selected_rows, artifacts.render_rows(selected_rows)):
+        st.image(thumbnail, caption=artifacts.row_caption(i), use_column_width=True)
+    if len(selected_rows) > 0:
+        st.markdown(f"Rendered {len(selected_rows)} menu items: {artifacts.payload_bytes / 1024:.0f} KB "
+                    f"in {artifacts.render_seconds * 1000:.0f} ms")
+    for label, table in artifacts.tables:
+        st.markdown(label)
+        st.dataframe(table)
 
 
 if __name__ == "__main__":
@@ -148,12 +189,18 @@ if __name__ == "__main__":
 
     # Sidebar to load an image
     st.sidebar.title("Load Image")
-    # any image type can be uploaded
-    input_image = st.sidebar.file_uploader("Upload an image", type=["png", "jpg", "jpeg"])
+    # any image type can be uploaded, or a screen recording of scrolling through the log
+    input_image = st.sidebar.file_uploader("Upload an image or a video", type=["png", "jpg", "jpeg"] + VIDEO_TYPES)
     if input_image is not None:
         st.sidebar.markdown("Input image loaded successfully")
     else:
         st.sidebar.markdown("Please upload an image")
+    # the results of a previous upload don't belong to a new one
+    input_key = None if input_image is None else (input_image.name, input_image.size)
+    if st.session_state.get('input_key') != input_key:
+        st.session_state.pop('results', None)
+        st.session_state.pop('artifacts', None)
+        st.session_state['input_key'] = input_key
 
     # Create a run button on the main screen if the image is loaded
     if input_image is not None:
@@ -162,45 +209,111 @@ if __name__ == "__main__":
     # Toggle button for displaying intermediate images
     display_intermediate_images = st.sidebar.checkbox("Display Intermediate Images", value=False)
 
+    # Toggle button for running text detection once on the whole menu instead of once per row
+    single_detection_pass = st.sidebar.checkbox("Single Detection Pass", value=False)
+
+    # Threads for running OCR and portrait matching of different rows at the same time
+    num_workers = st.sidebar.number_input("Worker Threads", min_value=2, value=3, step=1)
+
+    # Short side the text detector resizes its input to, see utils/det_scale_sweep.py for picking one
+    det_short_side = st.sidebar.number_input("Detection Short Side (0 = model default)", min_value=0, value=0, step=32)
+    det_short_side = None if det_short_side == 0 else int(det_short_side)
+
+    # Toggle button for recognizing low scoring or invalid texts again with padded and binarized crops
+    reverify_text = st.sidebar.checkbox("Re-recognize Doubtful Text", value=False)
+    reverify_variants = DEFAULT_VARIANTS if reverify_text else ()
+    # Boss levels outside this range are treated as misread, they change between seasons
+    boss_level_range = st.sidebar.slider("Valid Boss Levels", min_value=1, max_value=50, value=BOSS_LEVEL_RANGE)
+
     # Toogle button for mode selection
     mode = st.sidebar.radio("Mode", ["Overall", "Boss Specific"])
 
+    # Optionally append every run to the persistent results store
+    save_results = st.sidebar.checkbox("Save Results to Store", value=False)
+    if save_results:
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+        results_store_path = st.sidebar.text_input("Results Store Path", value=os.path.join(current_dir, '..', 'results_store'))
+        season = st.sidebar.number_input("Season", min_value=1, value=1, step=1)
+        day = st.sidebar.number_input("Day", min_value=1, value=1, step=1)
+
     # Main function
     if input_image is not None and run:
-        # load the image
-        image = Image.open(input_image)
-        # display the image
-        st.image(image, caption="Input Image", use_column_width=True)
-
-        menu = get_menu(image)
-        if display_intermediate_images:
-            # display the menu
-            st.image(menu, caption="Full Menu", use_column_width=True)
-
-        # get the menu
-        if mode == "Boss Specific":
-            commander_names, commander_damage, team_composition, boss_levels, unit_levels = mode_0(image)
-            results = pd.DataFrame({"Commander Name": commander_names, "Commander Damage": commander_damage, 
-                                    "Team Composition": team_composition, "Boss Level": boss_levels, "Unit Levels": unit_levels})
+        # boxes and crops for the intermediate images, rendered after the run
+        artifacts = ArtifactRecorder() if display_intermediate_images else None
+        extension = os.path.splitext(input_image.name)[1].lower().lstrip('.')
+        if extension in VIDEO_TYPES:
+            # OpenCV can only decode from a file
+            with tempfile.NamedTemporaryFile(suffix=f".{extension}") as video_file:
+                video_file.write(input_image.getvalue())
+                video_file.flush()
+                st.video(input_image)
+                # only frames that scrolled new rows into view are extracted
+                results = []
+                progress = st.empty()
+                for frame_index, menu, new_rows in iter_new_rows(video_file.name, mode):
+                    progress.markdown(f"Frame {frame_index}: {len(new_rows)} new rows")
+                    results.append(extract_results(menu, new_rows))
+            if len(results) == 0:
+                st.markdown("No Union Log rows were found in the video.")
+                st.stop()
+            # iter_new_rows already dropped the rows seen in earlier frames, equal hits are kept
+            results = pd.concat(results, ignore_index=True)
         else:
-            commander_names, commander_damage, boss_name, boss_level = mode_1(image)
-            results = pd.DataFrame({"Commander Name": commander_names, "Commander Damage": commander_damage, 
-                                    "Boss Name": boss_name, "Boss Level": boss_level})
+            # load the image
+            image = Image.open(input_image)
+            # decode into a single RGB buffer that every stage views into
+            # and resample it to the resolution the pipeline was tuned on
+            image = canonicalize(Frame.from_pil(image))
+
+            menu = get_menu(image)
+            if artifacts is not None:
+                # outline the menu on the uploaded image, boxes are only mapped back to it for display
+                artifacts.record_image("Input Image", image.source if image.source is not None else image, [menu.source_box()])
+                artifacts.record_image("Full Menu", menu)
+            else:
+                # display the image
+                st.image(input_image, caption="Input Image", use_column_width=True)
 
+            # get the menu
+            results = extract_results(menu)
+
+        # fields that couldn't be read (e.g. an empty damage string) become 0, their confidence is 0 as well
+        results['Commander Damage'] = pd.to_numeric(results['Commander Damage'], errors='coerce').fillna(0).astype(int)
+        results['Boss Level'] = pd.to_numeric(results['Boss Level'], errors='coerce').fillna(0).astype(int)
+
+        if save_results:
+            # a row is only as reliable as its least confident field
+            confidence = results[[column for column in CONFIDENCE_COLUMNS.values() if column in results]].min(axis=1)
+            records = pd.DataFrame({"commander": results["Commander Name"], "damage": results["Commander Damage"],
+                                    "level": results["Boss Level"], "confidence": confidence})
+            if mode == "Boss Specific":
+                records["team_composition"] = results["Team Composition"]
+            else:
+                records["boss"] = results["Boss Name"]
+            filepath = ResultsStore(results_store_path).append(records, season, day)
+            st.markdown(f"Saved {len(records)} results to `{filepath}`")
+
+        # kept for the reruns triggered by picking menu items to inspect or downloading the results
+        # without the screenshot or video frames the recorded crops view into
+        if artifacts is not None:
+            artifacts.release_sources()
+        st.session_state['results'] = results
+        st.session_state['artifacts'] = artifacts
+
+    if 'results' in st.session_state:
+        results = st.session_state['results']
         # display the results in a table
         st.markdown("## Tabulated Results")
-        results['Commander Damage'] = results['Commander Damage'].fillna(0).astype(int)
-        results['Boss Level'] = results['Boss Level'].fillna(0).astype(int)
         st.dataframe(results)
 
         # download the dataframe as a csv at the click of a button
         csv = results.to_csv(index=False)
-        # https://github.com/streamlit/streamlit/issues/4382
-        st.markdown("Unfortunately, clicking the download button will clear main screen. \
-            Please take a screenshot of the results before clicking the button if needed.")
         st.download_button(
             label="Download Results as CSV",
             data=csv,
             file_name="results.csv",
             mime="text/csv",
         )
+
+        if display_intermediate_images and st.session_state['artifacts'] is not None:
+            show_intermediate_images(st.session_state['artifacts'])
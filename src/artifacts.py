@@ -0,0 +1,98 @@
+import io
+import time
+from typing import List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from PIL import Image, ImageDraw
+import cv2
+
+from frame import Frame
+
+
+class ArtifactRecorder:
+    """ Intermediate images of a run, recorded as metadata and rendered on demand.
+
+        During the run only the crops (views into the screenshot, nothing is copied) and the
+        boxes and polygons found on them are kept. A thumbnail, at most max_side pixels on
+        its longest side with the overlays drawn on it, is JPEG encoded when a row is first
+        rendered and reused after that. payload_bytes and render_seconds cover the last call
+        to render_rows. Call release_sources before keeping the recorder across reruns, so
+        it doesn't hold on to the screenshots or video frames the crops view into.
+    """
+    def __init__(self, max_side: int = 640, jpeg_quality: int = 80) -> None:
+        self.max_side = max_side
+        self.jpeg_quality = jpeg_quality
+        self.images = []
+        self.rows = []
+        self.tables = []
+        self._thumbnails = {}
+        self.payload_bytes = 0
+        self.render_seconds = 0.0
+
+    def record_image(self, label: str, image: Frame, boxes: Sequence = ()) -> None:
+        self.images.append({'label': label, 'frame': image, 'boxes': list(boxes)})
+
+    def record_row(self, label: str, row: Frame, det_polygons: Sequence = (), portraits: Sequence[Frame] = (),
+                   portrait_ids: Optional[List[str]] = None) -> None:
+        # portraits from the watershed path are cut from a resized row, map them back onto the row
+        portrait_boxes = [portrait.source_box(target=row) for portrait in portraits]
+        self.rows.append({'label': label, 'frame': row, 'polygons': list(det_polygons),
+                          'portrait_boxes': portrait_boxes, 'portrait_ids': portrait_ids})
+
+    def record_table(self, label: str, table: pd.DataFrame) -> None:
+        self.tables.append((label, table))
+
+    def release_sources(self) -> None:
+        """ Render the thumbnails of the full images and copy the rows out of their screenshots.
+        """
+        self.render_images()
+        for image in self.images:
+            image['frame'] = None
+        # a new root frame holds only the row's pixels, the portrait boxes are already in its coordinates
+        for row in self.rows:
+            if row['frame'].parent is not None or row['frame'].source is not None:
+                row['frame'] = Frame(row['frame'].rgb.copy())
+
+    def thumbnail(self, image: Frame, polygons: Sequence = (), boxes: Sequence = ()) -> bytes:
+        """ JPEG of the downscaled image with text polygons in red and boxes in green.
+        """
+        scale = min(1.0, self.max_side / max(image.width, image.height))
+        if scale < 1.0:
+            pixels = cv2.resize(image.rgb, (max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+                                interpolation=cv2.INTER_AREA)
+        else:
+            pixels = image.rgb
+        # draw on the thumbnail, the screenshot is never copied at full resolution
+        thumbnail = Image.fromarray(pixels)
+        draw = ImageDraw.Draw(thumbnail)
+        for polygon in polygons:
+            draw.polygon((np.asarray(polygon, dtype=np.float64) * scale).tolist(), outline="red", width=2)
+        for box in boxes:
+            draw.rectangle((np.asarray(box, dtype=np.float64) * scale).tolist(), outline="lime", width=2)
+        buffer = io.BytesIO()
+        thumbnail.save(buffer, format='JPEG', quality=self.jpeg_quality)
+        return buffer.getvalue()
+
+    def _render(self, key: tuple, image: Frame, polygons: Sequence = (), boxes: Sequence = ()) -> bytes:
+        if key not in self._thumbnails:
+            self._thumbnails[key] = self.thumbnail(image, polygons, boxes)
+        return self._thumbnails[key]
+
+    def render_images(self) -> List[bytes]:
+        return [self._render(('image', i), image['frame'], boxes=image['boxes']) for i, image in enumerate(self.images)]
+
+    def render_rows(self, indices: Sequence[int]) -> List[bytes]:
+        start_time = time.perf_counter()
+        thumbnails = [self._render(('row', i), self.rows[i]['frame'], self.rows[i]['polygons'], self.rows[i]['portrait_boxes'])
+                      for i in indices]
+        self.render_seconds = time.perf_counter() - start_time
+        self.payload_bytes = sum(len(thumbnail) for thumbnail in thumbnails)
+        return thumbnails
+
+    def row_caption(self, index: int) -> str:
+        # the IDs of the matched portraits, when the row has them
+        row = self.rows[index]
+        if row['portrait_ids'] is None:
+            return row['label']
+        return f"{row['label']}: {', '.join(row['portrait_ids'])}"
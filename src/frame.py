@@ -0,0 +1,128 @@
+from typing import Optional, Tuple
+
+import numpy as np
+from PIL import Image
+import cv2
+
+
+class Frame:
+    """ A screenshot, or a region of one, backed by a single RGB uint8 buffer.
+
+        Crops are NumPy views into their parent's buffer, so cutting the menu,
+        rows and portraits out of a screenshot never copies pixels. The grayscale
+        and BGR derivatives are computed lazily, once on the root frame, and
+        every crop slices its own view out of them. A resized frame remembers the
+        frame it was resampled from, so boxes can be mapped back with source_box.
+    """
+    def __init__(self, rgb: np.ndarray, parent: Optional['Frame'] = None,
+                 box: Optional[Tuple[int, int, int, int]] = None) -> None:
+        if parent is None:
+            # the root frame owns one contiguous buffer that all crops view into
+            rgb = np.ascontiguousarray(rgb, dtype=np.uint8)
+        self.rgb = rgb
+        self.parent = parent
+        # (left, upper, right, lower) in the parent's coordinates, same order as PIL crop
+        self.box = box
+        # the frame this root was resampled from, if any
+        self.source = None
+        self._gray = None
+        self._bgr = None
+
+    @classmethod
+    def from_pil(cls, image: Image) -> 'Frame':
+        # remove alpha channel (or palette) if it exists so the buffer is always RGB
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        return cls(np.asarray(image))
+
+    @classmethod
+    def from_bgr(cls, image: np.ndarray) -> 'Frame':
+        # e.g. frames decoded by OpenCV, keep the BGR buffer as the cached derivative
+        frame = cls(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+        frame._bgr = np.ascontiguousarray(image)
+        return frame
+
+    @property
+    def width(self) -> int:
+        return self.rgb.shape[1]
+
+    @property
+    def height(self) -> int:
+        return self.rgb.shape[0]
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        # width, height to match PIL's convention
+        return self.width, self.height
+
+    def _slices(self) -> Tuple[slice, slice]:
+        left, upper, right, lower = self.box
+        return slice(upper, lower), slice(left, right)
+
+    @property
+    def gray(self) -> np.ndarray:
+        if self._gray is None:
+            if self.parent is None:
+                self._gray = cv2.cvtColor(self.rgb, cv2.COLOR_RGB2GRAY)
+            else:
+                self._gray = self.parent.gray[self._slices()]
+        return self._gray
+
+    @property
+    def bgr(self) -> np.ndarray:
+        # mmocr expects BGR input, and a reversed channel view has negative strides
+        # that torch can't consume, so materialize the root once and slice it
+        if self._bgr is None:
+            if self.parent is None:
+                self._bgr = cv2.cvtColor(self.rgb, cv2.COLOR_RGB2BGR)
+            else:
+                self._bgr = self.parent.bgr[self._slices()]
+        return self._bgr
+
+    def crop(self, box: Tuple[int, int, int, int]) -> 'Frame':
+        """ Return a view of the (left, upper, right, lower) region, clipped to the frame.
+        """
+        left, upper, right, lower = (int(v) for v in box)
+        left, right = max(0, left), min(self.width, right)
+        upper, lower = max(0, upper), min(self.height, lower)
+        box = (left, upper, right, lower)
+        return Frame(self.rgb[upper:lower, left:right], parent=self, box=box)
+
+    def resize(self, width: int, height: int) -> 'Frame':
+        """ Return a new root frame resampled to (width, height).
+        """
+        # area averaging when shrinking avoids aliasing, bicubic when enlarging
+        if width <= self.width and height <= self.height:
+            interpolation = cv2.INTER_AREA
+        else:
+            interpolation = cv2.INTER_CUBIC
+        resized = Frame(cv2.resize(self.rgb, (int(width), int(height)), interpolation=interpolation))
+        resized.source = self
+        return resized
+
+    def source_box(self, box: Optional[Tuple[int, int, int, int]] = None,
+                   target: Optional['Frame'] = None) -> Tuple[int, int, int, int]:
+        """ Map a (left, upper, right, lower) box in this frame (the whole frame by default) back
+            through every crop and resize to target, or to the originally decoded frame.
+        """
+        if box is None:
+            box = (0, 0, self.width, self.height)
+        left, upper, right, lower = (float(v) for v in box)
+        frame = self
+        while frame is not target and (frame.parent is not None or frame.source is not None):
+            if frame.parent is not None:
+                offset_x, offset_y = frame.box[:2]
+                left, right = left + offset_x, right + offset_x
+                upper, lower = upper + offset_y, lower + offset_y
+                frame = frame.parent
+            else:
+                scale_x = frame.source.width / frame.width
+                scale_y = frame.source.height / frame.height
+                left, right = left * scale_x, right * scale_x
+                upper, lower = upper * scale_y, lower * scale_y
+                frame = frame.source
+        return int(round(left)), int(round(upper)), int(round(right)), int(round(lower))
+
+    def to_pil(self) -> Image:
+        # copies the pixels, so only use this for display
+        return Image.fromarray(self.rgb)
@@ -1,19 +1,24 @@
-import numpy as np
-import os
-
-from PIL import Image
 import cv2
 
-def match_portrait(probe_image: Image, template_images_payload: dict) -> str:
+from frame import Frame
+
+def normalize_probe(probe_image: Frame) -> Frame:
     # resize the probe image to match the template image, which is 128x128, but keep the aspect ratio
     # make sure the resized image is at least 128x128
     # resize wants width, height
     if probe_image.height > probe_image.width:
-        resized_probe_image = probe_image.resize((128, int(128 * probe_image.height / probe_image.width)))
+        return probe_image.resize(128, int(128 * probe_image.height / probe_image.width))
     else:
-        resized_probe_image = probe_image.resize((int(128 * probe_image.width / probe_image.height), 128))
-    # split by channel and convert to numpy array
-    resized_probe_image = np.array(resized_probe_image)
+        return probe_image.resize(int(128 * probe_image.width / probe_image.height), 128)
+
+def match_portrait(probe_image: Frame, template_images_payload: dict) -> str:
+    return match_normalized_probe(normalize_probe(probe_image), template_images_payload)[0]
+
+def match_normalized_probe(resized_probe_image: Frame, template_images_payload: dict) -> tuple[str, float]:
+    """ Returns the best matching character name and its match score (sum of the RGB correlations).
+    """
+    # split by channel, these are views into the resized buffer
+    resized_probe_image = resized_probe_image.rgb
     resized_probe_image_r = resized_probe_image[:, :, 0]
     resized_probe_image_g = resized_probe_image[:, :, 1]
     resized_probe_image_b = resized_probe_image[:, :, 2]
@@ -46,4 +51,4 @@ def match_portrait(probe_image: Image, template_images_payload: dict) -> str:
     #sorted_gray_match_values = sorted(gray_match_values.items(), key=lambda x: x[1], reverse=True)
 
     # return the top 1 result
-    return sorted_rgb_match_values[0][0]
\ No newline at end of file
+    return sorted_rgb_match_values[0][0], float(sorted_rgb_match_values[0][1])
\ No newline at end of file
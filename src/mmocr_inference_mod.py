@@ -1,3 +1,4 @@
+import copy
 from typing import Dict, List, Optional, Tuple, Union
 
 import numpy as np
@@ -6,13 +7,27 @@ import torch
 from mmocr.utils import bbox2poly, crop_img, poly2bbox
 from mmocr.apis.inferencers import MMOCRInferencer
 from mmocr.apis.inferencers.base_mmocr_inferencer import InputsType, PredType, ConfigType
+from mmocr.structures import TextDetDataSample
 from mmengine.structures import InstanceData
 
 class MMOCRInferencer_merged_dets(MMOCRInferencer):
     """ Inherit from mmocr.apis.inferencers.mmocr_inferencer.MMOCRInferencer
         and modify the forward() method to merge overlapping quads before
         passing them to the text recognition model.
+
+        The text detector's input scale can also be chosen per call instead of
+        the model's default. Either pass det_short_side to resize the short side
+        of every input to a fixed size, or min_glyph_height to resize so that
+        text, assumed to be glyph_height_ratio of a row's height, is at least
+        that many pixels tall. The models are shared by all scales, only the
+        detection pipeline of every scale is cached.
+
+        Without either, forward_rows resizes the whole menu by the factor the
+        model's default Resize would apply to a single row, so the text is as
+        large as when every row is detected on its own.
     """
+    forward_kwargs: set = {'det_short_side', 'min_glyph_height'}
+
     def __init__(self,
                  det: Optional[Union[ConfigType, str]] = None,
                  det_weights: Optional[str] = None,
@@ -23,12 +38,70 @@ class MMOCRInferencer_merged_dets(MMOCRInferencer):
                  device: Optional[str] = None,
                  intersection_threshold: float = 0.01,
                  min_area: int = 100,
-                 det_score_threshold: float = 0.4
+                 det_score_threshold: float = 0.4,
+                 glyph_height_ratio: float = 0.15
                  ) -> None:
         super().__init__(det, det_weights, rec, rec_weights, kie, kie_weights, device)
         self.intersection_threshold = intersection_threshold
         self.min_area = min_area
         self.det_score_threshold = det_score_threshold
+        self.glyph_height_ratio = glyph_height_ratio
+        self._default_det_resize = None
+        if self.textdet_inferencer is not None:
+            self._default_det_pipeline = self.textdet_inferencer.pipeline
+            # the model's (long edge, short edge) limits, e.g. (4068, 1024) for DBNet++
+            self._default_det_resize = next((tuple(transform.scale) for transform in self._default_det_pipeline.transforms
+                                             if type(transform).__name__ == 'Resize'), None)
+        # detection pipelines keyed by the resize scale
+        self._det_pipelines = {}
+
+    def _det_scale(self, shape: Tuple[int, int], det_short_side: Optional[int] = None,
+                   min_glyph_height: Optional[float] = None,
+                   row_shape: Optional[Tuple[float, float]] = None) -> Optional[Tuple[int, int]]:
+        """
+        Compute the (long edge, short edge) scale for the detector's Resize, or None
+        to keep the model's default.
+        """
+        height, width = shape
+        short_side = min(height, width)
+        long_side = max(height, width)
+        if det_short_side is not None:
+            target_short_side = det_short_side
+        elif min_glyph_height is not None:
+            # without a hint, assume the input is a single row
+            row_height = height if row_shape is None else row_shape[0]
+            scale_factor = min_glyph_height / (self.glyph_height_ratio * row_height)
+            target_short_side = short_side * scale_factor
+        elif row_shape is not None and self._default_det_resize is not None:
+            # the factor keep_ratio Resize picks for a single (height, width) row
+            row_long_side, row_short_side = max(row_shape), min(row_shape)
+            scale_factor = min(max(self._default_det_resize) / row_long_side, min(self._default_det_resize) / row_short_side)
+            target_short_side = short_side * scale_factor
+        else:
+            return None
+        target_short_side = max(32, int(round(target_short_side)))
+        # with keep_ratio the smaller of the two ratios is used, so make sure the short side is the limit
+        target_long_side = int(np.ceil(target_short_side * long_side / short_side)) + 1
+        return target_long_side, target_short_side
+
+    def _use_det_pipeline(self, shape: Tuple[int, int], det_short_side: Optional[int] = None,
+                          min_glyph_height: Optional[float] = None,
+                          row_shape: Optional[Tuple[float, float]] = None) -> None:
+        """
+        Point the detector at the pipeline for this input shape and scale policy, building it on first use.
+        """
+        scale = self._det_scale(shape, det_short_side, min_glyph_height, row_shape)
+        if scale is None:
+            self.textdet_inferencer.pipeline = self._default_det_pipeline
+            return
+        if scale not in self._det_pipelines:
+            pipeline = copy.deepcopy(self._default_det_pipeline)
+            for transform in pipeline.transforms:
+                if type(transform).__name__ == 'Resize':
+                    transform.scale = scale
+                    transform.keep_ratio = True
+            self._det_pipelines[scale] = pipeline
+        self.textdet_inferencer.pipeline = self._det_pipelines[scale]
 
     def _intersection(self, box_1: np.ndarray, box_2: np.ndarray) -> float:
         """
@@ -40,12 +113,89 @@ class MMOCRInferencer_merged_dets(MMOCRInferencer):
         y2 = min(box_1[3], box_2[3])
         return max(0, x2 - x1 + 1) * max(0, y2 - y1 + 1)
 
+    def _merge_and_recognize(self, img: np.ndarray, det_data_sample: TextDetDataSample,
+                             rec_batch_size: int, **forward_kwargs) -> Tuple[TextDetDataSample, List]:
+        """
+        Merge overlapping detections, drop small or low scoring ones, and run text
+        recognition on the crops of what is left.
+        """
+        det_pred = det_data_sample.pred_instances
+
+        self.rec_rects = []
+        # Convert polygons to rectangles
+        for polygon in det_pred['polygons']:
+            # xyxy format
+            rect = poly2bbox(polygon)
+            self.rec_rects.append(rect)
+            
+        # Merge overlapping quads
+        merged_rectangles = []
+        for box_idx, box_1 in enumerate(self.rec_rects):
+            boxes_to_remove = []
+            for j, box_2_dict in enumerate(merged_rectangles):
+                # scale threshold by the size of the bounding box
+                box_2 = box_2_dict['xyxy']
+                intersection_threshold_scaled = self.intersection_threshold * (box_1[2] - box_1[0]) * (box_1[3] - box_1[1])
+                if self._intersection(box_1, box_2) > intersection_threshold_scaled:
+                    # resize the box to include the other box and move on to the next box
+                    box_1 = (min(box_1[0], box_2[0]), min(box_1[1], box_2[1]), max(box_1[2], box_2[2]), max(box_1[3], box_2[3]))
+                    boxes_to_remove.append(j)
+            # remove the boxes that were merged into box_1
+            for j in sorted(boxes_to_remove, reverse=True):
+                del merged_rectangles[j]
+            merged_rectangles.append({'xyxy': box_1, 'score': det_pred['scores'][box_idx]})
+
+        # could replace the next two steps with a list comprehension
+        # check for minimum area
+        area_filtered_rectangles = []
+        for box_dict in merged_rectangles:
+            box = box_dict['xyxy']
+            if (box[2] - box[0]) * (box[3] - box[1]) >= self.min_area:
+                area_filtered_rectangles.append(box_dict)
+
+        # check for minimum score
+        final_filtered_rectangles = []
+        for box_dict in area_filtered_rectangles:
+            if box_dict['score'] >= self.det_score_threshold:
+                final_filtered_rectangles.append(box_dict)
+        
+        # crop the image with the merged rectangles
+        self.rec_inputs = []
+        scores = []
+        polygons = []
+        for box_dict in final_filtered_rectangles:
+            # Roughly convert the polygon to a quadangle with
+            # 4 points
+            box = box_dict['xyxy']
+            quad = bbox2poly(box).tolist()
+            self.rec_inputs.append(crop_img(img, quad))
+            scores.append(box_dict['score'])
+            polygons.append(np.array(quad))
+
+        # modify the InstanceData object with the merged rectangles and scores
+        # https://github.com/open-mmlab/mmocr/blob/main/mmocr/structures/textdet_data_sample.py
+        # https://github.com/open-mmlab/mmengine/blob/main/mmengine/structures/instance_data.py
+        temp = InstanceData()
+        scores = torch.tensor(scores)
+        temp.scores = scores
+        temp.polygons = polygons
+        det_data_sample.pred_instances = temp
+        
+        rec_predictions = self.textrec_inferencer(
+            self.rec_inputs,
+            return_datasamples=True,
+            batch_size=rec_batch_size,
+            **forward_kwargs)['predictions']
+        return det_data_sample, rec_predictions
+
     def forward(self,
                 inputs: InputsType,
                 batch_size: int = 1,
                 det_batch_size: Optional[int] = None,
                 rec_batch_size: Optional[int] = None,
                 kie_batch_size: Optional[int] = None,
+                det_short_side: Optional[int] = None,
+                min_glyph_height: Optional[float] = None,
                 **forward_kwargs) -> PredType:
         """Forward the inputs to the model.
 
@@ -61,6 +211,11 @@ class MMOCRInferencer_merged_dets(MMOCRInferencer):
             kie_batch_size (Optional[int]): Batch size for KIE model.
                 Overwrite batch_size if it is not None.
                 Defaults to None.
+            det_short_side (Optional[int]): Short side to resize the
+                detector's input to. Defaults to None.
+            min_glyph_height (Optional[float]): Minimum text height in the
+                detector's input, used if det_short_side is None.
+                Defaults to None.
 
         Returns:
             Dict: The prediction results. Possibly with keys "det", "rec", and
@@ -84,6 +239,8 @@ class MMOCRInferencer_merged_dets(MMOCRInferencer):
                 **forward_kwargs)['predictions']
             result['rec'] = [[p] for p in predictions]
         elif self.mode.startswith('det'):  # 'det'/'det_rec'/'det_rec_kie'
+            # inputs are batched by size, so the first image's shape decides the detector's scale
+            self._use_det_pipeline(self._inputs2ndarrray(inputs)[0].shape[:2], det_short_side, min_glyph_height)
             result['det'] = self.textdet_inferencer(
                 inputs,
                 return_datasamples=True,
@@ -93,75 +250,10 @@ class MMOCRInferencer_merged_dets(MMOCRInferencer):
                 result['rec'] = []
                 for sample_idx, (img, det_data_sample) in enumerate(zip(
                         self._inputs2ndarrray(inputs), result['det'])):
-                    det_pred = det_data_sample.pred_instances
-
-                    self.rec_rects = []
-                    # Convert polygons to rectangles
-                    for polygon in det_pred['polygons']:
-                        # xyxy format
-                        rect = poly2bbox(polygon)
-                        self.rec_rects.append(rect)
-                        
-                    # Merge overlapping quads
-                    merged_rectangles = []
-                    for box_idx, box_1 in enumerate(self.rec_rects):
-                        boxes_to_remove = []
-                        for j, box_2_dict in enumerate(merged_rectangles):
-                            # scale threshold by the size of the bounding box
-                            box_2 = box_2_dict['xyxy']
-                            intersection_threshold_scaled = self.intersection_threshold * (box_1[2] - box_1[0]) * (box_1[3] - box_1[1])
-                            if self._intersection(box_1, box_2) > intersection_threshold_scaled:
-                                # resize the box to include the other box and move on to the next box
-                                box_1 = (min(box_1[0], box_2[0]), min(box_1[1], box_2[1]), max(box_1[2], box_2[2]), max(box_1[3], box_2[3]))
-                                boxes_to_remove.append(j)
-                        # remove the boxes that were merged into box_1
-                        for j in sorted(boxes_to_remove, reverse=True):
-                            del merged_rectangles[j]
-                        merged_rectangles.append({'xyxy': box_1, 'score': det_pred['scores'][box_idx]})
-
-                    # could replace the next two steps with a list comprehension
-                    # check for minimum area
-                    area_filtered_rectangles = []
-                    for box_dict in merged_rectangles:
-                        box = box_dict['xyxy']
-                        if (box[2] - box[0]) * (box[3] - box[1]) >= self.min_area:
-                            area_filtered_rectangles.append(box_dict)
-
-                    # check for minimum score
-                    final_filtered_rectangles = []
-                    for box_dict in area_filtered_rectangles:
-                        if box_dict['score'] >= self.det_score_threshold:
-                            final_filtered_rectangles.append(box_dict)
-                    
-                    # crop the image with the merged rectangles
-                    self.rec_inputs = []
-                    scores = []
-                    polygons = []
-                    for box_dict in final_filtered_rectangles:
-                        # Roughly convert the polygon to a quadangle with
-                        # 4 points
-                        box = box_dict['xyxy']
-                        quad = bbox2poly(box).tolist()
-                        self.rec_inputs.append(crop_img(img, quad))
-                        scores.append(box_dict['score'])
-                        polygons.append(np.array(quad))
-
-                    # modify the InstanceData object with the merged rectangles and scores
-                    # https://github.com/open-mmlab/mmocr/blob/main/mmocr/structures/textdet_data_sample.py
-                    # https://github.com/open-mmlab/mmengine/blob/main/mmengine/structures/instance_data.py
-                    temp = InstanceData()
-                    scores = torch.tensor(scores)
-                    temp.scores = scores
-                    temp.polygons = polygons
-                    det_data_sample.pred_instances = temp
-                    
+                    det_data_sample, rec_predictions = self._merge_and_recognize(
+                        img, det_data_sample, rec_batch_size, **forward_kwargs)
                     result['det'][sample_idx] = det_data_sample
-                    result['rec'].append(
-                        self.textrec_inferencer(
-                            self.rec_inputs,
-                            return_datasamples=True,
-                            batch_size=rec_batch_size,
-                            **forward_kwargs)['predictions'])
+                    result['rec'].append(rec_predictions)
                 if self.mode == 'det_rec_kie':
                     self.kie_inputs = []
                     # TODO: when the det output is empty, kie will fail
@@ -185,4 +277,74 @@ class MMOCRInferencer_merged_dets(MMOCRInferencer):
                         return_datasamples=True,
                         batch_size=kie_batch_size,
                         **forward_kwargs)['predictions']
-        return result
\ No newline at end of file
+        return result
+
+    def forward_rows(self,
+                     img: np.ndarray,
+                     row_boxes: List[Tuple[int, int, int, int]],
+                     rec_batch_size: int = 1,
+                     det_short_side: Optional[int] = None,
+                     min_glyph_height: Optional[float] = None,
+                     **forward_kwargs) -> PredType:
+        """Run text detection once on the whole image, then merge, filter and
+        recognize the detections row by row.
+
+        Args:
+            img (np.ndarray): The BGR image containing all the rows.
+            row_boxes (List[Tuple[int, int, int, int]]): (left, upper, right,
+                lower) of every row in img's coordinates. Rows may overlap.
+            rec_batch_size (int): Batch size for text recognition model.
+                Defaults to 1.
+            det_short_side (Optional[int]): Short side to resize the
+                detector's input to. Defaults to None.
+            min_glyph_height (Optional[float]): Minimum text height in the
+                detector's input, used if det_short_side is None.
+                Defaults to None.
+
+        Returns:
+            Dict: The prediction results with keys "det" and "rec", one entry
+            per row, with polygons in the row's coordinates.
+        """
+        forward_kwargs['progress_bar'] = False
+        # the glyph size follows the rows, not the whole image
+        row_shape = None
+        if len(row_boxes) > 0:
+            row_shape = (float(np.median([lower - upper for _, upper, _, lower in row_boxes])),
+                         float(np.median([right - left for left, _, right, _ in row_boxes])))
+        self._use_det_pipeline(img.shape[:2], det_short_side, min_glyph_height, row_shape)
+        det_pred = self.textdet_inferencer(
+            img,
+            return_datasamples=True,
+            batch_size=1,
+            **forward_kwargs)['predictions'][0].pred_instances
+        polygons = [np.asarray(polygon, dtype=np.float32) for polygon in det_pred['polygons']]
+        scores = det_pred['scores']
+        # a detection belongs to every row that contains the centre of its bounding box
+        centers = [((polygon[0::2].min() + polygon[0::2].max()) / 2,
+                    (polygon[1::2].min() + polygon[1::2].max()) / 2) for polygon in polygons]
+
+        result = {'det': [], 'rec': []}
+        for left, upper, right, lower in row_boxes:
+            row_img = img[upper:lower, left:right]
+            row_polygons = []
+            row_scores = []
+            for polygon, score, (center_x, center_y) in zip(polygons, scores, centers):
+                if not (left <= center_x < right and upper <= center_y < lower):
+                    continue
+                # move into the row's coordinates and clip so the crop stays inside the row
+                row_polygon = polygon.copy()
+                row_polygon[0::2] = np.clip(row_polygon[0::2] - left, 0, right - left - 1)
+                row_polygon[1::2] = np.clip(row_polygon[1::2] - upper, 0, lower - upper - 1)
+                row_polygons.append(row_polygon)
+                row_scores.append(float(score))
+
+            row_data_sample = TextDetDataSample()
+            row_pred = InstanceData()
+            row_pred.polygons = row_polygons
+            row_pred.scores = torch.tensor(row_scores)
+            row_data_sample.pred_instances = row_pred
+            row_data_sample, rec_predictions = self._merge_and_recognize(
+                row_img, row_data_sample, rec_batch_size, **forward_kwargs)
+            result['det'].append(row_data_sample)
+            result['rec'].append(rec_predictions)
+        return result
@@ -0,0 +1,138 @@
+import re
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+# letters that OCR confuses with digits
+OCR_DIGIT_TRANSLATION = str.maketrans('oOlIizZsSbBgGqQ', '001112255889999')
+
+# digits correctly split into groups of 3 by thousands separators, e.g. 315,198,714 or 714
+NUMBER_GROUPING = re.compile(r'\d{1,3}(,\d{3})*')
+NUMBER_GROUPING_PATTERN = NUMBER_GROUPING.pattern
+# any number, the recognizer's vocabulary usually drops the commas, e.g. 315198714
+NUMBER_PATTERN = r'\d{1,3}(,\d{3})*|\d+'
+
+
+def repair_digits(text: str) -> str:
+    """ Replace letters that look like digits with the digit, e.g. 'l0s' -> '105'.
+    """
+    return text.translate(OCR_DIGIT_TRANSLATION)
+
+
+def is_number_token(text: str) -> bool:
+    """ Check that a token is a number, after repairing letters, only if it already has a digit.
+        Words like 'BOSS' would otherwise be read as 8055.
+    """
+    return any(c.isdigit() for c in text) and repair_digits(text).replace(',', '').isdigit()
+
+
+def repair_level(text: str) -> Optional[str]:
+    """ Extract the level from a token like 'Lv.5' or 'lvs', returns None if there isn't one.
+    """
+    # split by 1st non-digit character
+    parts = re.split(r'\D+', text)
+    level = parts[1] if len(parts) > 1 else parts[0]
+    if level.isdigit():
+        return level
+    # the number might have been switched to a letter that looks like a number
+    # remove the 'lv' prefix and any punctuation after it
+    level = repair_digits(re.sub(r'^lv\W*', '', text, flags=re.IGNORECASE))
+    if level.isdigit():
+        return level
+    return None
+
+
+def is_well_grouped(text: str) -> bool:
+    """ Check that a number's thousands separators split it into groups of 3. Numbers longer
+        than 3 digits without separators aren't well grouped.
+    """
+    return NUMBER_GROUPING.fullmatch(text) is not None
+
+
+def _x_extent(polygon: Sequence[float]) -> tuple[float, float]:
+    # polygons are flat lists of x, y pairs
+    xs = polygon[0::2]
+    return min(xs), max(xs)
+
+
+def reconcile_number(texts: list, polygons: list, seam_tolerance: float = 0.25) -> str:
+    """ Merge the number crops of one field into a single digit string.
+
+        Adjacent crops sometimes both contain the digit at their seam, typically when a
+        crop boundary cuts through it. The duplicate is dropped where the x-extents of the
+        two crops overlap or touch (closer than seam_tolerance glyph widths), so a digit that
+        really repeats across a gap is kept. When the texts have thousands separators and that
+        doesn't give a correctly grouped number, every duplicate at a seam is dropped instead.
+        The recognizer's dictionary usually has no commas, then only the x-extents decide.
+    """
+    if len(texts) == 0:
+        return ''
+    # merge the numbers from left to right based on their polygon coordinates
+    extents = [_x_extent(polygon) for polygon in polygons]
+    order = sorted(range(len(texts)), key=lambda i: extents[i][0])
+    texts = [repair_digits(texts[i]) for i in order]
+    extents = [extents[i] for i in order]
+
+    overlap_trimmed = [texts[0]]
+    seam_trimmed = [texts[0]]
+    for i in range(1, len(texts)):
+        text = texts[i]
+        duplicate_seam = len(text) > 0 and len(texts[i-1]) > 0 and texts[i-1][-1] == text[0]
+        # estimate the glyph width from the two crops' widths and character counts
+        n_chars = max(1, len(texts[i-1]) + len(text))
+        glyph_width = (extents[i][1] - extents[i][0] + extents[i-1][1] - extents[i-1][0]) / n_chars
+        overlapping = extents[i][0] - extents[i-1][1] < seam_tolerance * glyph_width
+        overlap_trimmed.append(text[1:] if duplicate_seam and overlapping else text)
+        seam_trimmed.append(text[1:] if duplicate_seam else text)
+
+    number = ''.join(overlap_trimmed)
+    # the grouping can only be checked when the separators were recognized
+    if ',' in number and not is_well_grouped(number):
+        number = ''.join(seam_trimmed)
+    return number.replace(',', '')
+
+
+def reconcile_number_tokens(tokens: pd.DataFrame, seam_tolerance: float = 0.25) -> pd.DataFrame:
+    """ Bulk version of reconcile_number for batch imports.
+
+        tokens has one row per number crop with the columns 'row' (the field it belongs
+        to), 'text', 'x0' and 'x1'. Returns a frame indexed by 'row' with the merged
+        'number' string, the parsed 'value' (nullable Int64) and a 'valid' flag that is
+        False when the merged text isn't a number (e.g. badly placed commas or no digits).
+    """
+    tokens = tokens.sort_values(['row', 'x0'], kind='stable')
+    # missing texts (NaN from CSVs) are empty crops
+    text = tokens['text'].fillna('').astype('string').str.translate(OCR_DIGIT_TRANSLATION)
+    row = tokens['row'].to_numpy()
+
+    # compare every crop with its left neighbour in the same field
+    previous_text = text.shift(1)
+    x0 = tokens['x0'].to_numpy(dtype=float)
+    x1 = tokens['x1'].to_numpy(dtype=float)
+    previous_x0 = np.r_[np.nan, x0[:-1]]
+    previous_x1 = np.r_[np.nan, x1[:-1]]
+    same_field = np.r_[False, row[1:] == row[:-1]]
+    duplicate_seam = same_field & (previous_text.str[-1] == text.str[0]).fillna(False).to_numpy(dtype=bool)
+    # estimate the glyph width from the two crops' widths and character counts
+    n_chars = np.maximum(1, (previous_text.str.len() + text.str.len()).fillna(0).to_numpy(dtype=float))
+    glyph_width = (x1 - x0 + previous_x1 - previous_x0) / n_chars
+    with np.errstate(invalid='ignore'):
+        overlapping = x0 - previous_x1 < seam_tolerance * glyph_width
+
+    without_first = text.str[1:]
+    overlap_trimmed = text.where(~(duplicate_seam & overlapping), without_first)
+    seam_trimmed = text.where(~duplicate_seam, without_first)
+
+    candidates = pd.DataFrame({'row': row, 'overlap': overlap_trimmed.to_numpy(),
+                               'seam': seam_trimmed.to_numpy()})
+    merged = candidates.groupby('row', sort=True).agg({'overlap': ''.join, 'seam': ''.join})
+    # the grouping can only be checked when the separators were recognized
+    use_seam = merged['overlap'].str.contains(',', regex=False) & ~merged['overlap'].str.fullmatch(NUMBER_GROUPING_PATTERN)
+    number = merged['overlap'].where(~use_seam, merged['seam'])
+    valid = number.str.fullmatch(NUMBER_PATTERN)
+
+    number = number.str.replace(',', '', regex=False)
+    result = pd.DataFrame({'number': number, 'valid': valid})
+    result['value'] = pd.to_numeric(number.where(result['valid']), errors='coerce').astype('Int64')
+    return result
@@ -0,0 +1,80 @@
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Tuple
+
+from frame import Frame
+
+# marks the end of the rows in a stage's queue
+_END = object()
+
+
+class RowPipeline:
+    """ Run the OCR and portrait stages of every row concurrently.
+
+        The calling thread feeds the row crops into one bounded queue per stage, the
+        stages consume them on a thread pool, and the results are joined by row index
+        so the output order never depends on scheduling. The OCR stage always gets a
+        single worker because the mmocr engine keeps per-call state; the portrait stage
+        (OpenCV, scikit-image and NumPy, which release the GIL) gets the rest.
+
+        stats holds, per stage, the number of rows, the total time rows waited in the
+        stage's queue, and the total time spent working on them.
+    """
+    def __init__(self, ocr_stage: Callable[[int, Frame], Any], portrait_stage: Callable[[int, Frame], Any],
+                 num_workers: int = 2, queue_size: int = 4) -> None:
+        self.ocr_stage = ocr_stage
+        self.portrait_stage = portrait_stage
+        self.num_portrait_workers = max(1, num_workers - 1)
+        self.queue_size = queue_size
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+
+    def _consume(self, name: str, stage: Callable, stage_queue: queue.Queue, results: list, errors: list) -> None:
+        while True:
+            item = stage_queue.get()
+            if item is _END:
+                break
+            index, row, enqueue_time = item
+            start_time = time.perf_counter()
+            try:
+                results[index] = stage(index, row)
+            except Exception as e:
+                # keep draining so the producer never blocks on a full queue
+                errors.append(e)
+            end_time = time.perf_counter()
+            with self._stats_lock:
+                stats = self.stats[name]
+                stats['rows'] += 1
+                stats['queue_wait'] += start_time - enqueue_time
+                stats['busy'] += end_time - start_time
+
+    def run(self, rows: List[Frame]) -> List[Tuple[Any, Any]]:
+        """ Returns (OCR result, portrait result) for every row, in the order of rows.
+        """
+        self.stats = {name: {'rows': 0, 'queue_wait': 0.0, 'busy': 0.0} for name in ('ocr', 'portraits')}
+        ocr_results = [None] * len(rows)
+        portrait_results = [None] * len(rows)
+        errors = []
+        ocr_queue = queue.Queue(maxsize=self.queue_size)
+        portrait_queue = queue.Queue(maxsize=self.queue_size)
+
+        with ThreadPoolExecutor(max_workers=1 + self.num_portrait_workers) as executor:
+            futures = [executor.submit(self._consume, 'ocr', self.ocr_stage, ocr_queue, ocr_results, errors)]
+            for _ in range(self.num_portrait_workers):
+                futures.append(executor.submit(self._consume, 'portraits', self.portrait_stage, portrait_queue,
+                                               portrait_results, errors))
+            for index, row in enumerate(rows):
+                # blocks when a stage falls queue_size rows behind
+                ocr_queue.put((index, row, time.perf_counter()))
+                portrait_queue.put((index, row, time.perf_counter()))
+            ocr_queue.put(_END)
+            for _ in range(self.num_portrait_workers):
+                portrait_queue.put(_END)
+            for future in futures:
+                future.result()
+
+        if len(errors) > 0:
+            raise errors[0]
+        return list(zip(ocr_results, portrait_results))
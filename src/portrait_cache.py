@@ -0,0 +1,121 @@
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import numpy as np
+import cv2
+
+from frame import Frame
+from matcher import normalize_probe, match_normalized_probe
+
+
+def dhash(image: Frame, hash_size: int = 8) -> int:
+    """ Difference hash: one bit per horizontally adjacent pair of a (hash_size+1) x hash_size
+        grayscale thumbnail, set when the left pixel is brighter.
+    """
+    thumbnail = cv2.resize(image.gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = thumbnail[:, :-1] > thumbnail[:, 1:]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def portrait_db_version(template_images_payload: dict) -> str:
+    """ Fingerprint of the portrait database, so cached matches are dropped when it changes.
+    """
+    digest = hashlib.sha1()
+    for character_name in sorted(template_images_payload):
+        template_image = np.ascontiguousarray(template_images_payload[character_name])
+        digest.update(character_name.encode('utf-8'))
+        digest.update(str(template_image.shape).encode('utf-8'))
+        digest.update(template_image.tobytes())
+    return digest.hexdigest()
+
+
+class PortraitMatchCache:
+    """ LRU memo of match_portrait results keyed by the probe's perceptual hash.
+
+        The same units show up in the Union Log day after day, so a probe whose dHash is
+        within max_distance bits of a cached one reuses that match instead of scoring it
+        against the whole roster. Entries can be saved to and loaded from cache_filepath,
+        and are discarded when the portrait database changes.
+    """
+    def __init__(self, template_images_payload: dict, capacity: int = 4096, max_distance: int = 4,
+                 cache_filepath: Optional[str] = None) -> None:
+        self.template_images_payload = template_images_payload
+        self.capacity = capacity
+        self.max_distance = max_distance
+        self.cache_filepath = cache_filepath
+        self.db_version = portrait_db_version(template_images_payload)
+        # perceptual hash -> (character name, match score), least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if cache_filepath is not None:
+            self.load()
+
+    def _lookup(self, key: int) -> Optional[int]:
+        """ Return the cached hash nearest to key within max_distance, if any.
+        """
+        if key in self._entries:
+            return key
+        if len(self._entries) == 0 or self.max_distance <= 0:
+            return None
+        cached_keys = np.fromiter(self._entries.keys(), dtype=np.uint64, count=len(self._entries))
+        differing_bits = np.bitwise_xor(cached_keys, np.uint64(key))
+        distances = np.unpackbits(differing_bits.view(np.uint8)).reshape(len(cached_keys), -1).sum(axis=1)
+        nearest = int(np.argmin(distances))
+        if distances[nearest] <= self.max_distance:
+            return int(cached_keys[nearest])
+        return None
+
+    def match(self, probe_image: Frame) -> Tuple[str, float]:
+        """ Same as matcher.match_portrait but also returns the score, served from the cache on a near match.
+        """
+        normalized_probe = normalize_probe(probe_image)
+        key = dhash(normalized_probe)
+        with self._lock:
+            cached_key = self._lookup(key)
+            if cached_key is not None:
+                self.hits += 1
+                self._entries.move_to_end(cached_key)
+                return self._entries[cached_key]
+            self.misses += 1
+
+        # score outside the lock so other threads can keep hitting the cache
+        result = match_normalized_probe(normalized_probe, self.template_images_payload)
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+        return result
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def metrics(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hit_rate, 'entries': len(self._entries)}
+
+    def save(self, cache_filepath: Optional[str] = None) -> None:
+        cache_filepath = cache_filepath or self.cache_filepath
+        with self._lock:
+            payload = {'db_version': self.db_version, 'entries': list(self._entries.items())}
+        with open(cache_filepath, 'wb') as f:
+            pickle.dump(payload, f)
+
+    def load(self, cache_filepath: Optional[str] = None) -> None:
+        cache_filepath = cache_filepath or self.cache_filepath
+        if not os.path.exists(cache_filepath):
+            return
+        with open(cache_filepath, 'rb') as f:
+            payload = pickle.load(f)
+        # matches against an older portrait database are stale
+        if payload.get('db_version') != self.db_version:
+            return
+        with self._lock:
+            self._entries = OrderedDict(payload['entries'][-self.capacity:])
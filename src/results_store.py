@@ -0,0 +1,124 @@
+import os
+import uuid
+from typing import Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# columns stored inside each parquet file
+RESULTS_SCHEMA = pa.schema([
+    ('commander', pa.string()),
+    ('damage', pa.int64()),
+    ('boss', pa.string()),
+    ('level', pa.int16()),
+    ('kill', pa.bool_()),
+    ('team_composition', pa.list_(pa.string())),
+    ('confidence', pa.float32()),
+])
+# names of the aggregated columns returned by the queries
+AGGREGATE_COLUMNS = {'damage_sum': 'damage', 'damage_count': 'hits'}
+# columns encoded in the directory layout, e.g. season=7/day=1/
+PARTITION_SCHEMA = pa.schema([
+    ('season', pa.int16()),
+    ('day', pa.int8()),
+])
+DATASET_SCHEMA = pa.unify_schemas([RESULTS_SCHEMA, PARTITION_SCHEMA])
+
+
+class ResultsStore:
+    """ Append-only store of extracted raid results, partitioned by season and day.
+
+        Every append writes a new parquet file under <root>/season=<s>/day=<d>/, so
+        results can be written incrementally while screenshots are processed and
+        nothing already on disk is rewritten. Queries only read the columns they need.
+    """
+    def __init__(self, root: str) -> None:
+        self.root = root
+
+    def append(self, records: pd.DataFrame, season: int, day: int) -> Optional[str]:
+        """ Write the records (columns named as in RESULTS_SCHEMA, missing ones are null)
+            for one season and day. Returns the path of the new file, or None if empty.
+        """
+        if len(records) == 0:
+            return None
+        columns = {}
+        for field in RESULTS_SCHEMA:
+            if field.name in records:
+                columns[field.name] = pa.array(records[field.name], type=field.type, from_pandas=True)
+            else:
+                columns[field.name] = pa.nulls(len(records), type=field.type)
+        table = pa.table(columns, schema=RESULTS_SCHEMA)
+
+        partition_dir = os.path.join(self.root, f"season={int(season)}", f"day={int(day)}")
+        os.makedirs(partition_dir, exist_ok=True)
+        filepath = os.path.join(partition_dir, f"part-{uuid.uuid4().hex}.parquet")
+        pq.write_table(table, filepath)
+        return filepath
+
+    def dataset(self) -> ds.Dataset:
+        return ds.dataset(self.root, format='parquet', schema=DATASET_SCHEMA,
+                          partitioning=ds.partitioning(PARTITION_SCHEMA, flavor='hive'))
+
+    def read(self, columns: Optional[list] = None, season: Optional[int] = None,
+             day: Optional[int] = None) -> pa.Table:
+        """ Read only the requested columns, pruning partitions by season and day.
+        """
+        condition = None
+        if season is not None:
+            condition = pc.field('season') == season
+        if day is not None:
+            day_condition = pc.field('day') == day
+            condition = day_condition if condition is None else condition & day_condition
+        if not os.path.isdir(self.root):
+            # nothing has been appended yet
+            schema = DATASET_SCHEMA
+            if columns is not None:
+                schema = pa.schema([schema.field(name) for name in columns])
+            return schema.empty_table()
+        return self.dataset().to_table(columns=columns, filter=condition)
+
+    def member_totals(self, season: Optional[int] = None) -> pd.DataFrame:
+        """ Total damage and number of hits per commander.
+        """
+        table = self.read(columns=['commander', 'damage'], season=season)
+        totals = table.group_by('commander').aggregate([('damage', 'sum'), ('damage', 'count')])
+        return totals.to_pandas().rename(columns=AGGREGATE_COLUMNS).sort_values('damage', ascending=False, ignore_index=True)
+
+    def boss_damage(self, season: Optional[int] = None) -> pd.DataFrame:
+        """ Total damage and number of hits per boss and level.
+        """
+        table = self.read(columns=['boss', 'level', 'damage'], season=season)
+        totals = table.group_by(['boss', 'level']).aggregate([('damage', 'sum'), ('damage', 'count')])
+        return totals.to_pandas().rename(columns=AGGREGATE_COLUMNS).sort_values(['boss', 'level'], ignore_index=True)
+
+    def daily_totals(self, season: Optional[int] = None) -> pd.DataFrame:
+        """ Total damage and number of hits per season and day.
+        """
+        table = self.read(columns=['season', 'day', 'damage'], season=season)
+        totals = table.group_by(['season', 'day']).aggregate([('damage', 'sum'), ('damage', 'count')])
+        return totals.to_pandas().rename(columns=AGGREGATE_COLUMNS).sort_values(['season', 'day'], ignore_index=True)
+
+
+def import_results_csv(store: ResultsStore, csv_filepath: str, season: int) -> list:
+    """ Import a results CSV like assets/season_7_results.csv (Boss, Member, Damage, Notes, Day)
+        into the store, one append per day. Returns the written file paths.
+    """
+    df = pd.read_csv(csv_filepath)
+    # split "Laitance LvL 1" into the boss name and level
+    boss_level = df['Boss'].str.extract(r'^(?P<boss>.*?)\s*LvL\s*(?P<level>\d+)\s*$')
+    records = pd.DataFrame({
+        'commander': df['Member'],
+        'damage': df['Damage'].astype('int64'),
+        'boss': boss_level['boss'],
+        'level': pd.to_numeric(boss_level['level']).astype('Int16'),
+        'kill': df['Notes'].eq('K'),
+    })
+    days = pd.to_numeric(df['Day'].str.replace('Day', '', regex=False))
+
+    filepaths = []
+    for day, day_records in records.groupby(days, sort=True):
+        filepaths.append(store.append(day_records, season, day))
+    return filepaths
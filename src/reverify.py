@@ -0,0 +1,173 @@
+import time
+from typing import Sequence
+
+import numpy as np
+import cv2
+
+from mmlab_ocr import run_text_recognition, parse_ocr_overall_results, parse_ocr_boss_specific_results
+
+# texts recognized with a lower score than this are recognized again
+MIN_REC_SCORE = 0.9
+# plausible values of the numeric fields, season 7 has boss levels 1 to 10 and hits of up to 1.3 billion
+BOSS_LEVEL_RANGE = (1, 10)
+DAMAGE_RANGE = (1_000, 10_000_000_000)
+UNIT_LEVEL_RANGE = (1, 999)
+# fields of each mode, in the order the parsers return them
+MODE_FIELDS = {
+    'Overall': ('damage', 'name', 'boss_name', 'boss_level'),
+    'Boss Specific': ('damage', 'name', 'unit_level', 'boss_level'),
+}
+# the recognizer resizes every crop to 128x32, so the variants differ in framing and contrast instead of size
+# padding of each variant as a fraction of the text's height, see crop_variants
+VARIANT_PADDING = {'padded': 0.15, 'wide_padded': 0.4, 'binarized': 0.15, 'equalized': 0.15}
+DEFAULT_VARIANTS = ('padded', 'wide_padded', 'binarized')
+
+
+def parse_row(mode: str, rec_texts: list, det_polygons: list, width: int, height: int) -> tuple:
+    """ Returns the parsed fields of a row and the indices of the texts each field was read from.
+    """
+    field_tokens = {}
+    if mode == 'Boss Specific':
+        fields = parse_ocr_boss_specific_results(rec_texts, det_polygons, width, height, field_tokens=field_tokens)
+    else:
+        fields = parse_ocr_overall_results(rec_texts, det_polygons, width, height, field_tokens=field_tokens)
+    return fields, field_tokens
+
+
+def _in_range(value, value_range: tuple) -> bool:
+    return value is not None and str(value).isdigit() and value_range[0] <= int(value) <= value_range[1]
+
+
+def validate_fields(mode: str, fields: tuple, boss_level_range: tuple = BOSS_LEVEL_RANGE) -> dict:
+    """ Check every parsed field, e.g. that the damage is a number in a plausible range. The boss
+        levels change between seasons, so their range can be passed in.
+    """
+    values = dict(zip(MODE_FIELDS[mode], fields))
+    valid = {
+        'damage': _in_range(values['damage'], DAMAGE_RANGE),
+        'name': values['name'] is not None and len(values['name']) > 0,
+        'boss_level': _in_range(values['boss_level'], boss_level_range),
+    }
+    if mode == 'Boss Specific':
+        valid['unit_level'] = _in_range(values['unit_level'], UNIT_LEVEL_RANGE)
+    else:
+        valid['boss_name'] = len(values['boss_name']) > 0
+    return valid
+
+
+def field_confidences(mode: str, fields: tuple, field_tokens: dict, rec_scores: list, det_scores: list,
+                      boss_level_range: tuple = BOSS_LEVEL_RANGE) -> dict:
+    """ Confidence of every field: the lowest recognition x detection score of the texts it was
+        read from, or 0 if the field failed validation or wasn't found.
+    """
+    valid = validate_fields(mode, fields, boss_level_range)
+    confidences = {}
+    for field in MODE_FIELDS[mode]:
+        tokens = field_tokens.get(field, [])
+        if not valid[field] or len(tokens) == 0:
+            confidences[field] = 0.0
+        else:
+            confidences[field] = float(min(rec_scores[i] * det_scores[i] for i in tokens))
+    return confidences
+
+
+def crop_variants(image: np.ndarray, polygon: Sequence[float], variants: Sequence[str] = DEFAULT_VARIANTS) -> list:
+    """ Crops of one text from a BGR row. 'padded' and 'wide_padded' grow the detected box by
+        VARIANT_PADDING of its height on every side to recover glyphs the detector clipped,
+        'binarized' is the padded crop thresholded with Otsu's method and 'equalized' is it
+        with its contrast equalized (CLAHE).
+    """
+    xs, ys = np.asarray(polygon[0::2], dtype=np.float64), np.asarray(polygon[1::2], dtype=np.float64)
+    left, upper, right, lower = xs.min(), ys.min(), xs.max(), ys.max()
+    height, width = image.shape[:2]
+
+    crops = []
+    for variant in variants:
+        margin = VARIANT_PADDING[variant] * (lower - upper)
+        crop_left, crop_upper = max(0, int(np.floor(left - margin))), max(0, int(np.floor(upper - margin)))
+        crop_right, crop_lower = min(width, int(np.ceil(right + margin)) + 1), min(height, int(np.ceil(lower + margin)) + 1)
+        variant_crop = image[crop_upper:crop_lower, crop_left:crop_right]
+        if variant == 'binarized':
+            _, binary = cv2.threshold(cv2.cvtColor(variant_crop, cv2.COLOR_BGR2GRAY), 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+            variant_crop = cv2.cvtColor(binary, cv2.COLOR_GRAY2BGR)
+        elif variant == 'equalized':
+            gray = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(1, 4)).apply(cv2.cvtColor(variant_crop, cv2.COLOR_BGR2GRAY))
+            variant_crop = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+        # the recognizer needs a contiguous buffer
+        crops.append(np.ascontiguousarray(variant_crop))
+    return crops
+
+
+def _no_worse(before: dict, after: dict) -> bool:
+    # every field that was valid is still valid
+    return all(after[field] or not valid for field, valid in before.items())
+
+
+def reverify_rows(mode: str, images: list, predictions: list, min_rec_score: float = MIN_REC_SCORE,
+                  variants: Sequence[str] = DEFAULT_VARIANTS, boss_level_range: tuple = BOSS_LEVEL_RANGE,
+                  batch_size: int = 16, **ocr_kwargs) -> tuple:
+    """ Parse every row and recognize again only the texts that look wrong.
+
+        A text is flagged when its recognition score is below min_rec_score, or when a field read
+        from it fails validate_fields. The variants of every flagged text, over all rows, are
+        recognized in one batched pass. The readings that score higher than the original are tried
+        from the highest score down, and the first one after which no valid field of the row turns
+        invalid replaces it. Only the rows with such readings are parsed again.
+
+        images are the BGR rows the predictions (run_ocr's 'predictions' entries) were made on.
+        Returns the fields and field confidences of every row, the updated predictions, and stats.
+    """
+    start_time = time.perf_counter()
+    predictions = [dict(prediction, rec_texts=list(prediction['rec_texts']), rec_scores=list(prediction['rec_scores']))
+                   for prediction in predictions]
+    parsed = []
+    flagged = []
+    for row_index, (image, prediction) in enumerate(zip(images, predictions)):
+        height, width = image.shape[:2]
+        fields, field_tokens = parse_row(mode, prediction['rec_texts'], prediction['det_polygons'], width, height)
+        parsed.append((fields, field_tokens))
+        if len(variants) == 0:
+            continue
+        suspects = {i for i, score in enumerate(prediction['rec_scores']) if score < min_rec_score}
+        for field, valid in validate_fields(mode, fields, boss_level_range).items():
+            if not valid:
+                suspects.update(field_tokens.get(field, []))
+        flagged.extend((row_index, token) for token in sorted(suspects))
+
+    # every variant of every flagged text goes through the recognizer together
+    crops = []
+    for row_index, token in flagged:
+        crops.extend(crop_variants(images[row_index], predictions[row_index]['det_polygons'][token], variants))
+    readings = run_text_recognition(crops, batch_size=batch_size, **ocr_kwargs)
+
+    replaced = 0
+    rejected = 0
+    changed_rows = set()
+    for k, (row_index, token) in enumerate(flagged):
+        prediction = predictions[row_index]
+        height, width = images[row_index].shape[:2]
+        valid = validate_fields(mode, parsed[row_index][0], boss_level_range)
+        candidates = sorted(readings[k * len(variants):(k + 1) * len(variants)], key=lambda reading: reading[1], reverse=True)
+        for text, score in candidates:
+            if score <= prediction['rec_scores'][token]:
+                break
+            rec_texts = prediction['rec_texts'][:token] + [text] + prediction['rec_texts'][token + 1:]
+            row_parsed = parse_row(mode, rec_texts, prediction['det_polygons'], width, height)
+            # a higher score alone isn't enough, the reading must not break a field that parsed fine
+            if not _no_worse(valid, validate_fields(mode, row_parsed[0], boss_level_range)):
+                rejected += 1
+                continue
+            replaced += int(text != prediction['rec_texts'][token])
+            prediction['rec_texts'][token] = text
+            prediction['rec_scores'][token] = score
+            parsed[row_index] = row_parsed
+            changed_rows.add(row_index)
+            break
+
+    confidences = [field_confidences(mode, fields, field_tokens, prediction['rec_scores'], prediction['det_scores'],
+                                     boss_level_range)
+                   for (fields, field_tokens), prediction in zip(parsed, predictions)]
+    stats = {'rows': len(predictions), 'texts': sum(len(prediction['rec_texts']) for prediction in predictions),
+             'flagged': len(flagged), 'crops': len(crops), 'replaced': replaced, 'rejected': rejected,
+             'rows_changed': len(changed_rows), 'seconds': time.perf_counter() - start_time}
+    return [fields for fields, _ in parsed], confidences, predictions, stats
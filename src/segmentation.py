@@ -1,4 +1,5 @@
 from collections import Counter
+from functools import lru_cache
 import os
 
 import numpy as np
@@ -16,8 +17,27 @@ from skimage.measure import regionprops
 from skimage import measure
 from skimage import filters
 
-def get_menu(probe_image: Image) -> Image:
-    probe_image_gray = np.array(probe_image.convert("L"))
+from frame import Frame
+
+# the hard-coded parameters below (and the pixel thresholds of the OCR) were tuned on 1440p screenshots
+REFERENCE_HEIGHT = 1440
+
+
+def canonicalize(image: Frame, reference_height: int = REFERENCE_HEIGHT) -> Frame:
+    """ Resample a screenshot (or a menu crop) so its height is reference_height, keeping the aspect ratio.
+
+        The game's UI scales with the screen height, so after this every stage sees the Union Log at
+        the size it was tuned on and costs about the same whatever the capture resolution was.
+        Use Frame.source_box to map boxes back to the uploaded image.
+    """
+    if image.height == reference_height:
+        return image
+    scale = reference_height / image.height
+    return image.resize(max(1, int(round(image.width * scale))), reference_height)
+
+
+def get_menu(probe_image: Frame) -> Frame:
+    probe_image_gray = probe_image.gray
     # compute vertical edges
     sobel_x = cv2.Sobel(probe_image_gray, cv2.CV_64F, 1, 0, ksize=5)
     # compute horizontal edges
@@ -67,35 +87,39 @@ def get_menu(probe_image: Image) -> Image:
     target_peaks_y_coords = np.sort(target_peaks_y_coords)
     target_peaks_x_coords = target_peaks_x_coords.astype(int)
     target_peaks_y_coords = target_peaks_y_coords.astype(int)
+    # the crop is a view into the screenshot's buffer, the alpha channel was already dropped by Frame
     menu_image = probe_image.crop((target_peaks_x_coords[0], target_peaks_y_coords[0], target_peaks_x_coords[1], target_peaks_y_coords[1]))
 
-    # remove alpha channel if it exists
-    if menu_image.mode == 'RGBA':
-        menu_image = menu_image.convert('RGB')
-
     return menu_image
 
 
-def split_menu(menu_image: Image, mode: str) -> list[Image]:
-    # read in the template images
+@lru_cache(maxsize=None)
+def _load_row_template(mode: str) -> Frame:
+    # read in the template images once per process
     current_dir = os.path.dirname(os.path.abspath(__file__))
     if mode == 'Boss Specific':
         template_filepath = 'assets/boss_mode_row.png'
     else:
         template_filepath = 'assets/overall_mode_row.png'
     template_filepath = os.path.join(current_dir, '..', template_filepath)
-    template = Image.open(template_filepath)
+    return Frame.from_pil(Image.open(template_filepath))
 
+
+@lru_cache(maxsize=16)
+def _resized_row_template_gray(mode: str, new_width: int) -> np.ndarray:
     # resize the template to match the cropped image's width and keep the aspect ratio
-    new_width = menu_image.width
+    template = _load_row_template(mode)
     new_height = int(template.height * new_width / template.width)
-    resized_template = template.resize((new_width, new_height), Image.BICUBIC)
-    resized_template = np.array(resized_template)
-    np_menu_image = np.array(menu_image)
+    return template.resize(new_width, new_height).gray
+
+
+def split_menu(menu_image: Frame, mode: str) -> list[Frame]:
+    new_width = menu_image.width
+    resized_template_gray = _resized_row_template_gray(mode, new_width)
+    new_height = resized_template_gray.shape[0]
 
     # find the number of templates in the cropped image
-    resized_template_gray = cv2.cvtColor(resized_template, cv2.COLOR_RGB2GRAY)
-    menu_image_gray = cv2.cvtColor(np_menu_image, cv2.COLOR_RGB2GRAY)
+    menu_image_gray = menu_image.gray
     method = cv2.TM_CCOEFF_NORMED
     # match_result will be a 1D array of the match values because we matched widths
     match_result = cv2.matchTemplate(menu_image_gray, resized_template_gray, method)
@@ -107,22 +131,93 @@ def split_menu(menu_image: Image, mode: str) -> list[Image]:
     for peak in peaks:
         top_left = (0, peak)
         bottom_right = (top_left[0] + new_width, top_left[1] + new_height)
-        # crop the image using the target peaks
+        # crop the image using the target peaks (a view, no pixels are copied)
         cropped_row = menu_image.crop((top_left[0], top_left[1], bottom_right[0], bottom_right[1]))
         cropped_rows.append(cropped_row)
 
     return cropped_rows
     
-def get_portraits(input_image: Image) -> list[Image]:
+# portrait slots of a "Boss Specific" row as (left, upper, right, lower) fractions of the row's width and height
+# measured on rows cut by split_menu (which are wider than the template's tight crop of
+# assets/boss_mode_row.png), the boss comes first and then the 5 units from left to right
+PORTRAIT_SLOTS = [(0.118, 0.080, 0.271, 0.800)] + \
+    [(left, 0.523, left + 0.097, 0.875) for left in (0.318, 0.437, 0.554, 0.673, 0.791)]
+
+
+def _snap_edge(profile: np.ndarray, position: float, search_radius: int) -> int:
+    """ Move an edge to the strongest gradient within search_radius of the predicted position.
+    """
+    position = int(round(position))
+    start = max(0, position - search_radius)
+    stop = min(len(profile), position + search_radius + 1)
+    if stop <= start:
+        return min(max(position, 0), len(profile))
+    return start + int(np.argmax(profile[start:stop]))
+
+
+def locate_portrait_slots(input_image: Frame, search_fraction: float = 0.08, min_std: float = 20.0,
+                          min_border_contrast: float = 8.0, max_size_change: float = 0.2) -> list[Frame]:
+    """ Fast path for get_portraits: predict the 6 portrait boxes from the row geometry and snap
+        each edge to the strongest nearby gradient. Returns None if any portrait fails the checks.
+    """
+    gray = input_image.gray
+    width, height = input_image.size
+    # gradient magnitudes along each axis, only computed once for the row
+    gradient_x = np.abs(cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3))
+    gradient_y = np.abs(cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=3))
+
+    portraits = []
+    for slot in PORTRAIT_SLOTS:
+        left, upper, right, lower = slot[0] * width, slot[1] * height, slot[2] * width, slot[3] * height
+        search_x = max(1, int(search_fraction * (right - left)))
+        search_y = max(1, int(search_fraction * (lower - upper)))
+
+        # 1-D projections of the gradients over the predicted slot
+        column_profile = gradient_x[int(upper):int(lower)].mean(axis=0)
+        row_profile = gradient_y[:, int(left):int(right)].mean(axis=1)
+        snapped_left = _snap_edge(column_profile, left, search_x)
+        snapped_right = _snap_edge(column_profile, right, search_x)
+        snapped_upper = _snap_edge(row_profile, upper, search_y)
+        snapped_lower = _snap_edge(row_profile, lower, search_y)
+
+        # the snapped box should be about the size of the predicted one
+        snapped_width = snapped_right - snapped_left
+        snapped_height = snapped_lower - snapped_upper
+        if (abs(snapped_width - (right - left)) > max_size_change * (right - left) or
+                abs(snapped_height - (lower - upper)) > max_size_change * (lower - upper)):
+            return None
+
+        # a portrait is textured and stands out from what surrounds it
+        inside = gray[snapped_upper:snapped_lower, snapped_left:snapped_right]
+        if inside.size == 0 or inside.std() < min_std:
+            return None
+        ring = 3
+        outer = gray[max(0, snapped_upper - ring):snapped_lower + ring, max(0, snapped_left - ring):snapped_right + ring]
+        inner = inside[ring:-ring, ring:-ring]
+        outer_border_mean = (outer.sum(dtype=np.float64) - inside.sum(dtype=np.float64)) / max(1, outer.size - inside.size)
+        inner_border_mean = (inside.sum(dtype=np.float64) - inner.sum(dtype=np.float64)) / max(1, inside.size - inner.size)
+        if abs(inner_border_mean - outer_border_mean) < min_border_contrast:
+            return None
+
+        portraits.append(input_image.crop((snapped_left, snapped_upper, snapped_right, snapped_lower)))
+
+    return portraits
+
+
+def get_portraits(input_image: Frame, fast_path: bool = True) -> list[Frame]:
+    # the portraits usually sit at fixed positions in the row, only segment the row if they don't
+    if fast_path:
+        portraits = locate_portrait_slots(input_image)
+        if portraits is not None:
+            return portraits
+
     # resize the image to a higher resolution if needed
     # try to get 256x1024
     # compute scale factor from the original image
     resize_factor = 256 / input_image.height
-    resized_image = input_image.resize((int(input_image.width * resize_factor), 256), 
-        Image.BICUBIC)
-    np_resized_image = np.array(resized_image)
-    gray_resized_image = resized_image.convert('L')
-    np_gray_resized_image = np.array(gray_resized_image)
+    resized_image = input_image.resize(int(input_image.width * resize_factor), 256)
+    np_resized_image = resized_image.rgb
+    np_gray_resized_image = resized_image.gray
 
     # binarize the image to make the watershed algorithm work better
     threshold = filters.threshold_otsu(np_gray_resized_image)
@@ -202,6 +297,9 @@ def get_portraits(input_image: Image) -> list[Image]:
     # crop the image to the bounding box
     # PIL crop is (left, upper, right, lower) so convert the bounding box order
     bounding_boxes = [(bounding_box[1], bounding_box[0], bounding_box[3], bounding_box[2]) for bounding_box in bounding_boxes]
+    # order from left to right so the boss comes first, like the fast path
+    bounding_boxes = sorted(bounding_boxes, key=lambda bounding_box: bounding_box[0])
+    # portraits are views into the resized row
     cropped_images = [resized_image.crop(bounding_box) for bounding_box in bounding_boxes]
 
-    return cropped_images
\ No newline at end of file
+    return cropped_images
@@ -0,0 +1,114 @@
+from collections import deque
+from typing import Iterator, Tuple
+
+import numpy as np
+import cv2
+
+from frame import Frame
+from segmentation import canonicalize, get_menu, split_menu
+
+
+def _band_profile(menu: Frame, band_height: int = 4, band_width: int = 32) -> np.ndarray:
+    # mean brightness of coarse horizontal bands of the menu, cheap to compare between frames
+    return cv2.resize(menu.gray, (band_width, max(1, menu.height // band_height)),
+                      interpolation=cv2.INTER_AREA).astype(np.float32)
+
+
+def _scroll_shift(previous_gray: np.ndarray, gray: np.ndarray, min_score: float = 0.98):
+    """ How far the menu's content moved up between two frames, or None when it can't be matched
+        (e.g. it scrolled by more than two thirds of the menu).
+
+        Each third of the previous menu is looked up in the current one and the best match wins.
+        The rows share one template, so a wrong offset by a whole row still scores about 0.95;
+        min_score only accepts matches where the text lines up as well.
+    """
+    band_height = gray.shape[0] // 3
+    best_shift, best_score = None, min_score
+    for band_upper in (0, band_height, 2 * band_height):
+        band = previous_gray[band_upper:band_upper + band_height]
+        # the menus have the same width, so there is one score per vertical offset
+        scores = cv2.matchTemplate(gray, band, cv2.TM_CCOEFF_NORMED)[:, 0]
+        best = int(np.argmax(scores))
+        if scores[best] >= best_score:
+            best_shift, best_score = band_upper - best, scores[best]
+    return best_shift
+
+
+def iter_new_rows(video_filepath: str, mode: str, sample_fps: float = 5.0, duplicate_threshold: float = 2.0,
+                  remembered_rows: int = 64) -> Iterator[Tuple[int, Frame, list]]:
+    """ Stream a screen recording of the Union Log and yield (frame index, menu, new rows) for
+        every sampled frame that shows rows that haven't been seen yet.
+
+        The menu is located once on the first (canonicalized) frame. For the rest of the video
+        the same box is cropped out of each native frame and only the crop is resampled to the
+        reference resolution. Frames are decoded one at a time and only sample_fps frames per
+        second are converted; a frame is skipped when its band profile differs from the last
+        processed frame by less than duplicate_threshold gray levels.
+
+        The scroll displacement between processed frames is accumulated into an offset, so every
+        row gets a position in the whole log. A row is new unless a row was already seen within
+        half a row height of its position. Only the last remembered_rows positions are kept, so
+        memory doesn't grow with the length of the video. If the displacement can't be measured,
+        the positions are forgotten and every row of that frame counts as new.
+    """
+    capture = cv2.VideoCapture(video_filepath)
+    if not capture.isOpened():
+        raise ValueError(f"Could not open video {video_filepath}")
+    fps = capture.get(cv2.CAP_PROP_FPS)
+    frame_step = max(1, int(round(fps / sample_fps))) if fps > 0 else 1
+
+    menu_box = None
+    previous_profile = None
+    previous_gray = None
+    # how far the log has scrolled since the first frame, in menu pixels
+    scroll_offset = 0
+    seen_positions = deque(maxlen=remembered_rows)
+    frame_index = -1
+    try:
+        while True:
+            # grab() skips the color conversion of frames that aren't sampled
+            if not capture.grab():
+                break
+            frame_index += 1
+            if frame_index % frame_step != 0:
+                continue
+            ok, bgr = capture.retrieve()
+            if not ok:
+                break
+            frame = Frame.from_bgr(bgr)
+
+            if menu_box is None:
+                located_menu = get_menu(canonicalize(frame))
+                menu_box = located_menu.source_box()
+                menu_size = located_menu.size
+            # the first menu is cropped the same way as the rest, so its pixels match theirs
+            menu = frame.crop(menu_box)
+            if menu.size != menu_size:
+                menu = menu.resize(*menu_size)
+
+            # drop frames where the menu hasn't moved
+            profile = _band_profile(menu)
+            if previous_profile is not None and np.mean(np.abs(profile - previous_profile)) < duplicate_threshold:
+                continue
+            previous_profile = profile
+
+            if previous_gray is not None:
+                shift = _scroll_shift(previous_gray, menu.gray)
+                if shift is None:
+                    seen_positions.clear()
+                else:
+                    scroll_offset += shift
+            # copy, the menu is a view into a frame that is about to be released
+            previous_gray = menu.gray.copy()
+
+            new_rows = []
+            for row in split_menu(menu, mode):
+                position = row.box[1] + scroll_offset
+                if any(abs(position - seen_position) < row.height / 2 for seen_position in seen_positions):
+                    continue
+                seen_positions.append(position)
+                new_rows.append(row)
+            if len(new_rows) > 0:
+                yield frame_index, menu, new_rows
+    finally:
+        capture.release()
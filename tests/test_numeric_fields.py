@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+
+from numeric_fields import (is_number_token, is_well_grouped, reconcile_number, reconcile_number_tokens,
+                            repair_digits, repair_level)
+
+
+def box(left, right):
+    # flat x, y polygon of a 10 pixel high crop
+    return [left, 0, right, 0, right, 10, left, 10]
+
+
+def test_repair_digits_and_level():
+    assert repair_digits('l0s') == '105'
+    assert repair_level('Lv.5') == '5'
+    assert repair_level('lvs') == '5'
+    assert repair_level('lv.') is None
+
+
+def test_is_number_token():
+    # letters are only repaired in tokens that already have a digit
+    assert not is_number_token('BOSS')
+    assert is_number_token('1O5')
+    assert is_number_token('12,345')
+
+
+def test_is_well_grouped():
+    assert is_well_grouped('315,198,714')
+    assert is_well_grouped('714')
+    assert not is_well_grouped('31,5198,714')
+    # without separators there is no grouping to check
+    assert not is_well_grouped('315198714')
+
+
+def test_overlapping_seam_is_dropped():
+    assert reconcile_number(['12', '2,345'], [box(0, 20), box(19, 70)]) == '12345'
+
+
+def test_grouped_number_keeps_the_seam_digit_across_a_gap():
+    # 122,345 is correctly grouped, so the repeated digit is real
+    assert reconcile_number(['12', '2,345'], [box(0, 20), box(40, 90)]) == '122345'
+
+
+def test_numbers_without_separators_are_trimmed_by_overlap():
+    # the recognizer's dictionary has no commas, so only the x-extents decide
+    assert reconcile_number(['12', '2345'], [box(0, 20), box(19, 60)]) == '12345'
+    assert reconcile_number(['12', '2345'], [box(0, 20), box(60, 100)]) == '122345'
+
+
+def test_badly_grouped_number_falls_back_to_the_seam_trim():
+    # 1,2311,233 isn't grouped correctly, dropping the repeated 1 gives 1,231,233
+    assert reconcile_number(['1,231', '1,233'], [box(0, 50), box(80, 130)]) == '1231233'
+
+
+def test_crops_are_merged_left_to_right():
+    assert reconcile_number(['456', '123,'], [box(40, 70), box(0, 38)]) == '123456'
+    assert reconcile_number([], []) == ''
+
+
+def test_reconcile_number_tokens_matches_reconcile_number():
+    tokens = pd.DataFrame({'row': [0, 0, 1, 1, 2, 3],
+                           'text': ['3456', '123', np.nan, '1,234', 'abc', '1,231'],
+                           'x0': [40, 0, 0, 10, 0, 0],
+                           'x1': [80, 30, 8, 40, 5, 50]})
+    result = reconcile_number_tokens(tokens)
+    # a gap between the crops, the repeated 3 is kept
+    assert result.loc[0, 'number'] == reconcile_number(['123', '3456'], [box(0, 30), box(40, 80)]) == '1233456'
+    assert result.loc[0, 'value'] == 1233456
+    # a missing text is an empty crop
+    assert result.loc[1, 'number'] == '1234'
+    assert not result.loc[2, 'valid']
+    assert pd.isna(result.loc[2, 'value'])
+    assert result['valid'].tolist() == [True, True, False, True]
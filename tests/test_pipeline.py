@@ -0,0 +1,60 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from frame import Frame
+from pipeline import RowPipeline
+
+
+def make_rows(count):
+    return [Frame(np.full((4, 4, 3), i, dtype=np.uint8)) for i in range(count)]
+
+
+def test_results_are_in_row_order():
+    def ocr_stage(index, row):
+        # later rows finish first
+        time.sleep(0.001 * (10 - index))
+        return ('ocr', int(row.rgb[0, 0, 0]))
+
+    def portrait_stage(index, row):
+        time.sleep(0.001 * (index % 3))
+        return ('portraits', index)
+
+    pipeline = RowPipeline(ocr_stage, portrait_stage, num_workers=3, queue_size=2)
+    results = pipeline.run(make_rows(10))
+    assert results == [(('ocr', i), ('portraits', i)) for i in range(10)]
+    assert pipeline.stats['ocr']['rows'] == 10
+    assert pipeline.stats['portraits']['rows'] == 10
+    assert pipeline.stats['ocr']['busy'] > 0
+
+
+def test_ocr_stage_runs_on_one_thread():
+    ocr_threads = set()
+
+    def ocr_stage(index, row):
+        ocr_threads.add(threading.get_ident())
+        return index
+
+    pipeline = RowPipeline(ocr_stage, lambda index, row: index, num_workers=4)
+    pipeline.run(make_rows(20))
+    assert len(ocr_threads) == 1
+
+
+def test_no_rows():
+    pipeline = RowPipeline(lambda index, row: index, lambda index, row: index)
+    assert pipeline.run([]) == []
+
+
+def test_stage_errors_are_raised_after_draining():
+    def portrait_stage(index, row):
+        if index == 1:
+            raise ValueError("bad row")
+        return index
+
+    pipeline = RowPipeline(lambda index, row: index, portrait_stage, num_workers=2, queue_size=1)
+    with pytest.raises(ValueError, match="bad row"):
+        pipeline.run(make_rows(8))
+    # the other rows were still consumed, so the producer never blocked
+    assert pipeline.stats['ocr']['rows'] == 8
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+import portrait_cache
+from frame import Frame
+from portrait_cache import PortraitMatchCache, dhash, portrait_db_version
+
+
+@pytest.fixture
+def payload():
+    rng = np.random.default_rng(0)
+    return {name: rng.integers(0, 256, (128, 128, 3), dtype=np.uint8) for name in ("Rapi", "Anis", "Neon")}
+
+
+@pytest.fixture
+def count_matches(monkeypatch):
+    # count the probes scored against the roster
+    calls = []
+    match_normalized_probe = portrait_cache.match_normalized_probe
+
+    def counting_match(probe, template_images_payload):
+        calls.append(probe)
+        return match_normalized_probe(probe, template_images_payload)
+    monkeypatch.setattr(portrait_cache, 'match_normalized_probe', counting_match)
+    return calls
+
+
+def probe(image, noise=0, seed=1):
+    rng = np.random.default_rng(seed)
+    noisy = image.astype(np.int16) + rng.integers(-noise, noise + 1, image.shape)
+    return Frame(np.clip(noisy, 0, 255).astype(np.uint8))
+
+
+def test_dhash_is_stable_under_noise(payload):
+    image = payload["Rapi"]
+    assert dhash(Frame(image)) == dhash(Frame(image.copy()))
+    distance = bin(dhash(Frame(image)) ^ dhash(probe(image, noise=2))).count('1')
+    assert distance <= 4
+    assert dhash(Frame(image), hash_size=16).bit_length() <= 256
+
+
+def test_near_duplicates_hit_the_cache(payload, count_matches):
+    cache = PortraitMatchCache(payload)
+    name, score = cache.match(Frame(payload["Anis"]))
+    assert name == "Anis"
+    assert cache.match(probe(payload["Anis"], noise=2)) == (name, score)
+    assert len(count_matches) == 1
+    assert cache.metrics() == {'hits': 1, 'misses': 1, 'hit_rate': 0.5, 'entries': 1}
+    assert cache.match(Frame(payload["Neon"]))[0] == "Neon"
+    assert len(count_matches) == 2
+
+
+def test_capacity_evicts_least_recently_used(payload, count_matches):
+    cache = PortraitMatchCache(payload, capacity=2)
+    for name in ("Rapi", "Anis", "Rapi", "Neon"):
+        cache.match(Frame(payload[name]))
+    # Anis was the least recently used when Neon was added
+    assert cache.metrics()['entries'] == 2
+    cache.match(Frame(payload["Rapi"]))
+    cache.match(Frame(payload["Anis"]))
+    assert len(count_matches) == 4
+
+
+def test_save_and_load(payload, tmp_path, count_matches):
+    cache_filepath = str(tmp_path / "portrait_match_cache.pkl")
+    cache = PortraitMatchCache(payload, cache_filepath=cache_filepath)
+    cache.match(Frame(payload["Rapi"]))
+    cache.save()
+
+    reloaded = PortraitMatchCache(payload, cache_filepath=cache_filepath)
+    assert reloaded.match(Frame(payload["Rapi"]))[0] == "Rapi"
+    assert reloaded.hits == 1
+    assert len(count_matches) == 1
+
+
+def test_cache_is_dropped_when_the_database_changes(payload, tmp_path):
+    cache_filepath = str(tmp_path / "portrait_match_cache.pkl")
+    cache = PortraitMatchCache(payload, cache_filepath=cache_filepath)
+    cache.match(Frame(payload["Rapi"]))
+    cache.save()
+
+    changed_payload = dict(payload, Rapi=255 - payload["Rapi"])
+    assert portrait_db_version(changed_payload) != portrait_db_version(payload)
+    assert PortraitMatchCache(changed_payload, cache_filepath=cache_filepath).metrics()['entries'] == 0
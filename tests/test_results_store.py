@@ -0,0 +1,63 @@
+import os
+
+import pandas as pd
+import pytest
+
+from results_store import ResultsStore, import_results_csv
+
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'assets')
+
+
+def test_append_read_round_trip(tmp_path):
+    store = ResultsStore(str(tmp_path / "store"))
+    records = pd.DataFrame({'commander': ["Karnath", "Frogg"], 'damage': [49280688, 1_300_000_000],
+                            'boss': ["Laitance", "Sinister"], 'level': [1, 3], 'confidence': [0.95, 0.5]})
+    filepath = store.append(records, season=7, day=2)
+    assert os.path.exists(filepath)
+    assert os.path.join("season=7", "day=2") in filepath
+
+    table = store.read().to_pandas().sort_values('commander', ignore_index=True)
+    assert table['commander'].tolist() == ["Frogg", "Karnath"]
+    assert table['damage'].tolist() == [1_300_000_000, 49280688]
+    assert table['level'].tolist() == [3, 1]
+    assert table['season'].tolist() == [7, 7]
+    assert table['day'].tolist() == [2, 2]
+    # columns that weren't given are null
+    assert table['kill'].isna().all()
+    assert table['confidence'].tolist() == pytest.approx([0.5, 0.95])
+
+
+def test_read_prunes_by_season_and_day(tmp_path):
+    store = ResultsStore(str(tmp_path / "store"))
+    for season, day in [(7, 1), (7, 2), (8, 1)]:
+        store.append(pd.DataFrame({'commander': [f"s{season}d{day}"], 'damage': [1000]}), season, day)
+    assert store.read(columns=['commander'], season=7, day=2)['commander'].to_pylist() == ["s7d2"]
+    assert sorted(store.read(columns=['commander'], season=7)['commander'].to_pylist()) == ["s7d1", "s7d2"]
+
+
+def test_empty_store(tmp_path):
+    store = ResultsStore(str(tmp_path / "missing"))
+    assert store.append(pd.DataFrame({'commander': [], 'damage': []}), 7, 1) is None
+    assert store.read(columns=['commander', 'damage']).num_rows == 0
+
+
+def test_import_results_csv(tmp_path):
+    csv_filepath = os.path.join(ASSETS_DIR, "season_7_results.csv")
+    df = pd.read_csv(csv_filepath)
+    store = ResultsStore(str(tmp_path / "store"))
+
+    filepaths = import_results_csv(store, csv_filepath, season=7)
+    # one file per day
+    assert len(filepaths) == df['Day'].nunique()
+
+    table = store.read().to_pandas()
+    assert len(table) == len(df)
+    assert table['damage'].sum() == df['Damage'].sum()
+    assert table['kill'].sum() == (df['Notes'] == 'K').sum()
+    assert "Laitance" in set(table['boss'])
+    assert table['level'].between(1, 10).all()
+
+    totals = store.member_totals(season=7)
+    expected = df.groupby('Member')['Damage'].sum()
+    assert dict(zip(totals['commander'], totals['damage'])) == expected.to_dict()
+    assert store.daily_totals()['hits'].sum() == len(df)
@@ -0,0 +1,82 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from visualize_raid_results import prepare_results, fit_trendlines
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", help="number of hits per synthetic season", type=int, default=100000)
+    parser.add_argument("--seasons", help="number of synthetic seasons", type=int, default=3)
+    parser.add_argument("--members", help="number of members per season", type=int, default=32)
+    parser.add_argument("--repeats", help="number of timed repeats", type=int, default=3)
+    parser.add_argument("--legacy", help="also time the row-wise apply implementation", action="store_true")
+    args = parser.parse_args()
+    return args
+
+def synthetic_season(rows: int, members: int, source: str, rng: np.random.Generator) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """ Random results and members in the same layout as assets/season_7_*.csv
+    """
+    bosses = np.array(["Laitance", "Sinister", "Chatterbox", "Vulcan R", "Alteisen MK.VI"])
+    member_names = np.array([f"Member{i}" for i in range(members)])
+    df = pd.DataFrame({
+        "Boss": pd.Series(rng.choice(bosses, rows)) + " LvL " + pd.Series(rng.integers(1, 10, rows)).astype(str),
+        "Member": rng.choice(member_names, rows),
+        "Damage": rng.integers(10_000_000, 2_000_000_000, rows),
+        "Notes": np.where(rng.random(rows) < 0.2, "K", ""),
+        "Day": "Day " + pd.Series(rng.integers(1, 6, rows)).astype(str),
+        "Source": source,
+    })
+    df_members = pd.DataFrame({"Member": member_names, "Synchro LvL": rng.integers(200, 450, members), "Source": source})
+    return df, df_members
+
+def legacy_prepare(df: pd.DataFrame, df_members: pd.DataFrame) -> pd.DataFrame:
+    # the original row-wise preparation, kept here as the baseline
+    df = df.copy()
+    df[["Boss", "Level"]] = df["Boss"].str.split("LvL", expand=True)
+    df = df.rename(columns={"Notes": "Kill"})
+    df["Kill"] = df["Kill"].apply(lambda x: True if x == "K" else False)
+    df["Damage (M)"] = df["Damage"].apply(lambda x: x / 1000000)
+    df = df.drop(columns=["Damage"])
+    df["Day"] = df["Day"].apply(lambda x: int(x.replace("Day", "")))
+    df = pd.merge(df, df_members, on=["Source", "Member"])
+    for day in df["Day"].unique():
+        df_day = df[df["Day"] == day]
+        np.polyfit(df_day["Synchro LvL"].values, df_day["Damage (M)"].values, 1)
+    for boss in df["Boss"].unique():
+        df_boss = df[df["Boss"] == boss]
+        hover_text = df_boss["Member"] + "<br>" + \
+            "Boss Level: " + df_boss["Level"].astype(str) + "<br>" + \
+            "Synchro Level: " + df_boss["Synchro LvL"].astype(str) + "<br>" + \
+            "Damage: " + df_boss["Damage (M)"].astype(str) + "<br>" + \
+            "Day: " + df_boss["Day"].astype(str) + "<br>" + \
+            "Kill: " + df_boss["Kill"].astype(str)
+    return df
+
+def vectorized_prepare(df: pd.DataFrame, df_members: pd.DataFrame) -> pd.DataFrame:
+    prepared = prepare_results(df, df_members)
+    fit_trendlines(prepared)
+    return prepared
+
+def time_it(function, repeats: int, *args) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+if __name__ == "__main__":
+    args = get_args()
+
+    rng = np.random.default_rng(0)
+    seasons = [synthetic_season(args.rows, args.members, f"season_{i}", rng) for i in range(args.seasons)]
+    df = pd.concat([season[0] for season in seasons], ignore_index=True)
+    df_members = pd.concat([season[1] for season in seasons], ignore_index=True)
+
+    print(f"{len(df)} rows over {args.seasons} seasons")
+    print(f"vectorized: {time_it(vectorized_prepare, args.repeats, df, df_members):.3f} s")
+    if args.legacy:
+        print(f"legacy:     {time_it(legacy_prepare, args.repeats, df, df_members):.3f} s")
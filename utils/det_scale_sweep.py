@@ -0,0 +1,132 @@
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+import time
+
+from PIL import Image
+
+# the pipeline lives with the dashboard code
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from frame import Frame
+from segmentation import canonicalize, get_menu, split_menu
+from mmlab_ocr import run_ocr, parse_ocr_overall_results, parse_ocr_boss_specific_results
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images_dir", help="directory of screenshots with ground truth JSONs, see synthesize_union_log.py", default="../synthetic_union_log/2560x1440")
+    parser.add_argument("--num_images", help="number of screenshots to use", type=int, default=20)
+    parser.add_argument("--mode", help="extraction mode of the screenshots", choices=["Overall", "Boss Specific"], default="Overall")
+    parser.add_argument("--short_sides", help="detector short sides to try", type=int, nargs="*", default=[96, 128, 192, 256, 384, 512])
+    parser.add_argument("--min_glyph_heights", help="minimum glyph heights (pixels) to try", type=float, nargs="*", default=[12, 16, 24])
+    args = parser.parse_args()
+    return args
+
+def load_labelled_rows(images_dir: str, mode: str, num_images: int) -> tuple:
+    """ Segment the generated screenshots of a mode and pair every row with the ground truth row
+        whose box contains its center. The ground truth text boxes are mapped into the row's pixels
+        as 'row_text_boxes'. Returns the rows and their ground truth (None if unmatched), and the
+        number of ground truth rows and text boxes.
+    """
+    rows = []
+    truths = []
+    num_truth_rows = 0
+    num_truth_boxes = 0
+    mode_name = mode.lower().replace(' ', '_')
+    for json_filepath in sorted(glob.glob(os.path.join(images_dir, f"{mode_name}_*.json")))[:num_images]:
+        with open(json_filepath) as f:
+            ground_truth = json.load(f)
+        image_filepath = next(filepath for filepath in glob.glob(os.path.splitext(json_filepath)[0] + '.*')
+                              if not filepath.endswith('.json'))
+        num_truth_rows += len(ground_truth['rows'])
+        num_truth_boxes += sum(len(truth['text_boxes']) for truth in ground_truth['rows'])
+        menu = get_menu(canonicalize(Frame.from_pil(Image.open(image_filepath))))
+        for row in split_menu(menu, mode):
+            # the ground truth boxes are in the screenshot's pixels
+            left, upper, right, lower = row.source_box()
+            center_x, center_y = (left + right) / 2, (upper + lower) / 2
+            truth = next((truth for truth in ground_truth['rows']
+                          if truth['box'][0] <= center_x < truth['box'][2] and truth['box'][1] <= center_y < truth['box'][3]), None)
+            if truth is not None:
+                scale_x, scale_y = row.width / (right - left), row.height / (lower - upper)
+                truth = dict(truth, row_text_boxes=[((box[0] - left) * scale_x, (box[1] - upper) * scale_y,
+                                                     (box[2] - left) * scale_x, (box[3] - upper) * scale_y)
+                                                    for box in truth['text_boxes']])
+            rows.append(row)
+            truths.append(truth)
+    return rows, truths, num_truth_rows, num_truth_boxes
+
+def extract_fields(rows: list, mode: str, **ocr_kwargs) -> list:
+    """ OCR every row and return the parsed fields of each row as a tuple, and the detected polygons.
+    """
+    fields = []
+    polygons = []
+    for row in rows:
+        prediction = run_ocr(row.bgr, **ocr_kwargs)['predictions'][0]
+        polygons.append(prediction['det_polygons'])
+        width, height = row.size
+        if mode == "Boss Specific":
+            fields.append(parse_ocr_boss_specific_results(prediction['rec_texts'], prediction['det_polygons'], width, height))
+        else:
+            fields.append(parse_ocr_overall_results(prediction['rec_texts'], prediction['det_polygons'], width, height))
+    return fields, polygons
+
+def truth_fields(truth: dict, mode: str) -> tuple:
+    # in the order the parsers return the fields
+    if mode == "Boss Specific":
+        return str(truth['damage']), truth['commander'], truth['unit_level'], str(truth['level'])
+    return str(truth['damage']), truth['commander'], truth['boss'], str(truth['level'])
+
+def _normalize(field) -> str:
+    # the recognizer's vocabulary has no case and no spaces
+    return '' if field is None else re.sub(r'\s+', '', str(field)).lower()
+
+def field_recall(fields: list, truths: list, num_truth_rows: int, mode: str) -> float:
+    """ Fraction of the ground truth fields that are read correctly. Rows that weren't segmented
+        count as missed.
+    """
+    matched = 0
+    for row_fields, truth in zip(fields, truths):
+        if truth is None:
+            continue
+        matched += sum(_normalize(field) == _normalize(truth_field) for field, truth_field in zip(row_fields, truth_fields(truth, mode)))
+    total = 4 * num_truth_rows
+    return matched / total if total > 0 else float('nan')
+
+def detection_recall(polygons: list, truths: list, num_truth_boxes: int, min_coverage: float = 0.5) -> float:
+    """ Fraction of the ground truth text boxes that are at least min_coverage covered by the
+        bounding box of one detection. Unlike field_recall, recognition and parsing errors don't count.
+    """
+    covered = 0
+    for row_polygons, truth in zip(polygons, truths):
+        if truth is None:
+            continue
+        detected_boxes = [(min(polygon[0::2]), min(polygon[1::2]), max(polygon[0::2]), max(polygon[1::2])) for polygon in row_polygons]
+        for left, upper, right, lower in truth['row_text_boxes']:
+            area = max(1e-6, (right - left) * (lower - upper))
+            covered += int(any(max(0, min(right, box[2]) - max(left, box[0])) * max(0, min(lower, box[3]) - max(upper, box[1]))
+                               >= min_coverage * area for box in detected_boxes))
+    return covered / num_truth_boxes if num_truth_boxes > 0 else float('nan')
+
+if __name__ == "__main__":
+    args = get_args()
+
+    rows, truths, num_truth_rows, num_truth_boxes = load_labelled_rows(args.images_dir, args.mode, args.num_images)
+    print(f"{len(rows)} rows ({sum(truth is not None for truth in truths)} of {num_truth_rows} labelled rows found), "
+          f"median row height {sorted(row.height for row in rows)[len(rows)//2]} px")
+
+    policies = [("model default", {})]
+    policies += [(f"short side {short_side}", {'det_short_side': short_side}) for short_side in args.short_sides]
+    policies += [(f"min glyph {glyph_height:g} px", {'min_glyph_height': glyph_height}) for glyph_height in args.min_glyph_heights]
+
+    print(f"{'policy':<20} {'det recall':>10} {'field recall':>12} {'s/row':>8}")
+    for name, ocr_kwargs in policies:
+        # load the models and build the policy's pipeline before timing
+        extract_fields(rows[:1], args.mode, **ocr_kwargs)
+        start = time.perf_counter()
+        fields, polygons = extract_fields(rows, args.mode, **ocr_kwargs)
+        latency = (time.perf_counter() - start) / max(1, len(rows))
+        print(f"{name:<20} {detection_recall(polygons, truths, num_truth_boxes):>10.2%} "
+              f"{field_recall(fields, truths, num_truth_rows, args.mode):>12.2%} {latency:>8.3f}")
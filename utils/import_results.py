@@ -0,0 +1,23 @@
+import argparse
+import os
+import sys
+
+# the results store lives with the dashboard code
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from results_store import ResultsStore, import_results_csv
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--results_file", help="path to the results file", default="../assets/season_7_results.csv")
+    parser.add_argument("--season", help="season the results belong to", type=int, default=7)
+    parser.add_argument("--results_store", help="path to the results store", default="../results_store")
+    args = parser.parse_args()
+    return args
+
+if __name__ == "__main__":
+    args = get_args()
+
+    store = ResultsStore(args.results_store)
+    filepaths = import_results_csv(store, args.results_file, args.season)
+    print(f"Wrote {len(filepaths)} files to {args.results_store}")
+    print(store.daily_totals(season=args.season))
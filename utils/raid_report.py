@@ -0,0 +1,125 @@
+import hashlib
+import os
+import pickle
+import re
+
+import pandas as pd
+import plotly.graph_objs as go
+
+from visualize_raid_results import damage_vs_level_figure, trendline_sums, fit_from_sums, with_source, member_labels, member_order
+
+# one day of one results file is the unit that gets cached
+DAY_KEYS = ["Source", "Day"]
+# columns that feed the aggregates, a change to any of them invalidates that day
+FINGERPRINT_COLUMNS = ["Boss", "Level", "Member", "Kill", "Damage (M)", "Synchro LvL"]
+
+
+class AggregationCache:
+    """ On-disk cache of the per-day aggregates behind the report.
+
+        Each (Source, Day) is fingerprinted from its rows, in order. Only days whose fingerprint
+        changed, e.g. a newly added day of results, are aggregated again; the others are
+        read back from the cache. Both aggregates are additive, so the cached days are
+        combined without touching their rows.
+    """
+    def __init__(self, cache_dir: str) -> None:
+        self.cache_dir = cache_dir
+        # days that were aggregated again by the last call to aggregate()
+        self.recomputed = []
+
+    def _filepath(self, source: str, day: int) -> str:
+        source = re.sub(r'[^\w.-]', '_', str(source))
+        return os.path.join(self.cache_dir, f"{source}_day{int(day)}.pkl")
+
+    def _load(self, source: str, day: int) -> dict:
+        filepath = self._filepath(source, day)
+        if not os.path.exists(filepath):
+            return None
+        with open(filepath, 'rb') as f:
+            return pickle.load(f)
+
+    def _save(self, source: str, day: int, entry: dict) -> None:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(self._filepath(source, day), 'wb') as f:
+            pickle.dump(entry, f)
+
+    def aggregate(self, df: pd.DataFrame) -> dict:
+        """ Returns the damage, hits and kills per (Member, Boss) as 'bars' and the
+            least-squares sums per Day as 'trendline_sums', both also per Source when
+            several sources are loaded.
+        """
+        if "Source" not in df:
+            df = df.assign(Source="results")
+        # digest of each day's row hashes in row order, a sum could collide and missed reordered rows
+        row_hashes = pd.util.hash_pandas_object(df[FINGERPRINT_COLUMNS], index=False).to_numpy()
+        day_rows = pd.DataFrame({column: df[column].to_numpy() for column in DAY_KEYS}) \
+            .groupby(DAY_KEYS, sort=True, observed=True).indices
+        fingerprints = {key: hashlib.sha256(row_hashes[rows].tobytes()).hexdigest() for key, rows in day_rows.items()}
+
+        entries = {}
+        stale_keys = []
+        for key, fingerprint in fingerprints.items():
+            entry = self._load(*key)
+            if entry is not None and entry['fingerprint'] == fingerprint:
+                entries[key] = entry
+            else:
+                stale_keys.append(key)
+
+        self.recomputed = stale_keys
+        if len(stale_keys) > 0:
+            # aggregate only the rows of the days that changed
+            day_index = pd.MultiIndex.from_arrays([df[column].to_numpy() for column in DAY_KEYS])
+            stale_rows = df[day_index.isin(stale_keys)]
+            bars = stale_rows.groupby(DAY_KEYS + ["Member", "Boss"], sort=False, observed=True) \
+                .agg(damage=("Damage (M)", "sum"), hits=("Damage (M)", "size"), kills=("Kill", "sum"))
+            sums = trendline_sums(stale_rows, DAY_KEYS)
+            for key in stale_keys:
+                entries[key] = {'fingerprint': fingerprints[key],
+                                'bars': bars.xs(key, level=DAY_KEYS),
+                                'trendline_sums': sums.loc[[key]]}
+                self._save(*key, entries[key])
+
+        bars = pd.concat([entry['bars'].assign(Source=key[0]) for key, entry in entries.items()]) \
+            .groupby(with_source(df, ["Member", "Boss"]), sort=False, observed=True)[["damage", "hits", "kills"]].sum()
+        sums = pd.concat([entry['trendline_sums'] for entry in entries.values()]) \
+            .groupby(level=with_source(df, ["Day"]), sort=True) \
+            .agg({"n": "sum", "x": "sum", "y": "sum", "xx": "sum", "xy": "sum", "x_min": "min", "x_max": "max"})
+        return {'bars': bars.reset_index(), 'trendline_sums': sums}
+
+
+def aggregated_bar_figure(bars: pd.DataFrame, df: pd.DataFrame, df_members: pd.DataFrame) -> go.Figure:
+    """ Stacked damage per member and boss from pre-aggregated bars, one bar segment
+        per (Member, Boss) instead of one per hit.
+    """
+    order = member_order(df, df_members)
+    # members of different sources get separate bars
+    bars = bars.assign(Member=member_labels(bars))
+    fig = go.Figure()
+    for boss, bars_boss in bars.groupby("Boss", sort=False, observed=True):
+        fig.add_trace(go.Bar(x=bars_boss["Member"], y=bars_boss["damage"], name=boss,
+                             customdata=bars_boss[["hits", "kills"]].to_numpy(),
+                             hovertemplate="%{x}<br>Damage: %{y:.0f}<br>Hits: %{customdata[0]}<br>Kills: %{customdata[1]}"))
+    # add the totals as an annotation on top of each bar
+    totals = bars.groupby("Member", observed=True)["damage"].sum()
+    fig.update_layout(annotations=[go.layout.Annotation(x=member, y=round(total)+100, text=f"{total:.0f}", showarrow=False) for \
+        member, total in zip(totals.index, totals.to_numpy())])
+    fig.update_xaxes(categoryorder='array', categoryarray=order)
+    fig.update_layout(title="Damage vs Member", xaxis_title="Member (Ordered by Synchro Level)", yaxis_title="Damage (M)",
+                      legend_title="Boss", barmode='stack',
+                      legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1))
+    return fig
+
+
+def write_report(filepath: str, df: pd.DataFrame, df_members: pd.DataFrame, aggregates: dict,
+                 max_points: int = None) -> None:
+    """ Write both charts into one HTML file with plotly.js inlined, so it opens offline.
+    """
+    trendlines = fit_from_sums(aggregates['trendline_sums'])
+    fig = damage_vs_level_figure(df, trendlines=trendlines, webgl=True, max_points=max_points)
+    fig2 = aggregated_bar_figure(aggregates['bars'], df, df_members)
+
+    with open(filepath, 'w', encoding='utf-8') as f:
+        f.write("<!DOCTYPE html>\n<html>\n<head><meta charset=\"utf-8\"><title>Union Raid Report</title></head>\n<body>\n")
+        f.write(fig.to_html(full_html=False, include_plotlyjs=True))
+        f.write(fig2.to_html(full_html=False, include_plotlyjs=False))
+        f.write("</body>\n</html>\n")
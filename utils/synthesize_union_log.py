@@ -0,0 +1,258 @@
+import argparse
+import json
+import os
+import pickle
+import re
+import sys
+import time
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+from PIL import Image, ImageDraw, ImageFont
+
+# the reference geometry lives with the dashboard code
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from segmentation import REFERENCE_HEIGHT
+
+BACKGROUND_COLOR = (24, 26, 32)
+MENU_COLOR = (236, 239, 242)
+HEADER_COLOR = (40, 140, 230)
+
+# per mode, the menu in a 2560x1440 screenshot (the box get_menu finds in the example screenshots), the
+# width of a row as a fraction of the menu's, and the regions of the row template that get repainted as
+# (left, upper, right, lower) in template pixels
+ROW_LAYOUTS = {
+    'Overall': {
+        'menu_box': (911, 343, 1648, 1208),
+        'row_width': 0.907,
+        'template': 'overall_mode_row.png',
+        'level': (92, 35, 178, 85),
+        'commander': (255, 60, 620, 115),
+        'boss': (325, 155, 600, 210),
+        # the damage is right aligned in the Overall rows
+        'damage': (990, 65, 1195, 125),
+    },
+    'Boss Specific': {
+        'menu_box': (933, 218, 1626, 1231),
+        'row_width': 0.882,
+        'template': 'boss_mode_row.png',
+        'level': (100, 18, 160, 55),
+        'commander': (230, 35, 420, 78),
+        'damage': (280, 85, 400, 122),
+        'portraits': [(left, 130, left + 98, 238) for left in (248, 369, 489, 608, 728)],
+    },
+}
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_images", help="number of screenshots to generate per mode", type=int, default=100)
+    parser.add_argument("--mode", help="extraction mode(s) of the screenshots", nargs="+", choices=["Overall", "Boss Specific"], default=["Overall"])
+    parser.add_argument("--resolutions", help="resolutions to write every screenshot at, as WIDTHxHEIGHT", nargs="+", default=["2560x1440"])
+    parser.add_argument("--results_file", help="path to the results file", default="../assets/season_7_results.csv")
+    parser.add_argument("--member_file", help="path to the member file", default="../assets/season_7_members.csv")
+    parser.add_argument("--portrait_db", help="path to the portrait database (Boss Specific mode)", default="../assets/nikke_images.pkl")
+    parser.add_argument("--font", help="path to a TrueType font, Pillow's bundled font by default", default=None)
+    parser.add_argument("--output_dir", help="directory to write the screenshots and ground truth to", default="../synthetic_union_log")
+    parser.add_argument("--format", help="image format of the screenshots", choices=["png", "jpg"], default="png")
+    parser.add_argument("--workers", help="number of processes", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", help="seed of the first screenshot, screenshot i uses seed + i", type=int, default=0)
+    args = parser.parse_args()
+    return args
+
+
+def parse_resolution(resolution: str) -> tuple:
+    width, height = re.fullmatch(r'(\d+)x(\d+)', resolution).groups()
+    return int(width), int(height)
+
+
+def load_font(font_filepath: str, size: int) -> ImageFont.FreeTypeFont:
+    # a sized default font needs Pillow 10.1
+    if font_filepath is None:
+        return ImageFont.load_default(size=size)
+    return ImageFont.truetype(font_filepath, size)
+
+
+def load_sources(results_file: str, member_file: str, portrait_db: str, modes: list) -> dict:
+    """ Everything a screenshot is sampled from, loaded once per process.
+    """
+    results = pd.read_csv(results_file)
+    # e.g. "Laitance LvL 1"
+    boss = results["Boss"].str.extract(r'^(?P<boss>.*?)\s*LvL\s*(?P<level>\d+)$')
+    hits = pd.DataFrame({"boss": boss["boss"], "level": pd.to_numeric(boss["level"]),
+                         "damage": pd.to_numeric(results["Damage"], errors='coerce')}).dropna()
+    members = pd.read_csv(member_file)["Member"].dropna().astype(str).unique()
+
+    portraits = None
+    if "Boss Specific" in modes:
+        with open(portrait_db, 'rb') as f:
+            portraits = pickle.load(f)
+
+    templates = {mode: Image.open(os.path.join(os.path.dirname(results_file), ROW_LAYOUTS[mode]['template'])).convert('RGB')
+                 for mode in modes}
+    return {'hits': hits.reset_index(drop=True), 'members': members, 'portraits': portraits, 'templates': templates}
+
+
+def _fill_background(draw_image: Image, box: tuple) -> None:
+    # paint over the template's text with the median color of the box's border
+    region = np.asarray(draw_image.crop(box))
+    border = np.concatenate([region[0], region[-1], region[:, 0], region[:, -1]])
+    color = tuple(int(v) for v in np.median(border, axis=0))
+    ImageDraw.Draw(draw_image).rectangle(box, fill=color)
+
+
+def _draw_text(draw_image: Image, box: tuple, text: str, font_filepath: str, color: tuple, align: str = 'left') -> list:
+    left, upper, right, lower = box
+    # largest font that fits the box
+    size = int(0.85 * (lower - upper))
+    font = load_font(font_filepath, size)
+    while size > 8 and font.getlength(text) > right - left:
+        size -= 2
+        font = load_font(font_filepath, size)
+    draw = ImageDraw.Draw(draw_image)
+    text_left, text_upper, text_right, text_lower = draw.textbbox((0, 0), text, font=font)
+    x = left - text_left if align == 'left' else right - text_right
+    y = (upper + lower) / 2 - (text_upper + text_lower) / 2
+    draw.text((x, y), text, fill=color, font=font)
+    # the box the text covers, for scoring text detection
+    return [x + text_left, y + text_upper, x + text_right, y + text_lower]
+
+
+def _fit_portrait(portrait: np.ndarray, size: tuple) -> Image:
+    # scale to cover the slot and crop the center, like the in-game cards
+    image = Image.fromarray(portrait).convert('RGB')
+    width, height = size
+    scale = max(width / image.width, height / image.height)
+    image = image.resize((max(width, round(image.width * scale)), max(height, round(image.height * scale))), Image.LANCZOS)
+    left, upper = (image.width - width) // 2, (image.height - height) // 2
+    return image.crop((left, upper, left + width, upper + height))
+
+
+def render_row(mode: str, sources: dict, rng: np.random.Generator, font_filepath: str) -> tuple:
+    """ Returns a row in template pixels and its ground truth.
+    """
+    layout = ROW_LAYOUTS[mode]
+    row = sources['templates'][mode].copy()
+    hit = sources['hits'].iloc[rng.integers(len(sources['hits']))]
+    # commander names are shown in upper case, the ground truth is what is drawn
+    commander = str(sources['members'][rng.integers(len(sources['members']))]).upper()
+    truth = {'commander': commander, 'damage': int(hit['damage']), 'level': int(hit['level'])}
+
+    for field in ('level', 'commander', 'damage') + (('boss',) if 'boss' in layout else ()):
+        _fill_background(row, layout[field])
+    text_boxes = [_draw_text(row, layout['level'], f"LV. {truth['level']}", font_filepath, (255, 255, 255)),
+                  _draw_text(row, layout['commander'], commander, font_filepath, (72, 72, 76)),
+                  _draw_text(row, layout['damage'], f"{truth['damage']:,}", font_filepath, (60, 60, 64),
+                             align='right' if mode == 'Overall' else 'left')]
+
+    if mode == 'Overall':
+        truth['boss'] = str(hit['boss'])
+        text_boxes.append(_draw_text(row, layout['boss'], truth['boss'], font_filepath, (40, 40, 44)))
+    else:
+        names = sorted(sources['portraits'])
+        team_composition = [names[i] for i in rng.choice(len(names), size=len(layout['portraits']), replace=False)]
+        unit_level = str(int(rng.integers(160, 401)))
+        for name, box in zip(team_composition, layout['portraits']):
+            left, upper, right, lower = box
+            row.paste(_fit_portrait(sources['portraits'][name], (right - left, lower - upper)), (left, upper))
+            # the unit level is overlaid on the lower left of every card
+            level_box = (left + 4, upper + int(0.62 * (lower - upper)), left + int(0.55 * (right - left)), lower - 6)
+            ImageDraw.Draw(row).rectangle(level_box, fill=(40, 40, 40))
+            text_boxes.append(_draw_text(row, level_box, unit_level, font_filepath, (255, 255, 255)))
+        truth['team_composition'] = team_composition
+        truth['unit_level'] = unit_level
+    truth['text_boxes'] = text_boxes
+    return row, truth
+
+
+def render_screenshot(mode: str, sources: dict, seed: int, width: int, font_filepath: str) -> tuple:
+    """ Returns a screenshot REFERENCE_HEIGHT pixels high with the menu centered, and its ground truth.
+    """
+    rng = np.random.default_rng(seed)
+    screenshot = Image.new('RGB', (width, REFERENCE_HEIGHT), BACKGROUND_COLOR)
+    # centered like the game on wider screens
+    offset = (width - 2560) // 2
+    left, upper, right, lower = ROW_LAYOUTS[mode]['menu_box']
+    left, right = left + offset, right + offset
+    draw = ImageDraw.Draw(screenshot)
+    # the header of the Union Log sits on top of the menu
+    draw.rectangle((left, max(0, upper - 130), right, upper), fill=HEADER_COLOR)
+    draw.rectangle((left, upper, right, lower), fill=MENU_COLOR)
+
+    rows = []
+    template = sources['templates'][mode]
+    row_width = round(ROW_LAYOUTS[mode]['row_width'] * (right - left))
+    row_height = round(template.height * row_width / template.width)
+    row_left = left + (right - left - row_width) // 2
+    row_upper = upper + int(rng.integers(0, row_height // 2))
+    while row_upper < lower:
+        row, truth = render_row(mode, sources, rng, font_filepath)
+        row = row.resize((row_width, row_height), Image.LANCZOS)
+        # the last row is cut off by the bottom of the menu, it isn't part of the ground truth
+        visible_height = min(row_height, lower - row_upper)
+        screenshot.paste(row.crop((0, 0, row_width, visible_height)), (row_left, row_upper))
+        if visible_height == row_height:
+            truth['box'] = [row_left, row_upper, row_left + row_width, row_upper + row_height]
+            # from template pixels to the screenshot's
+            scale = row_width / template.width
+            truth['text_boxes'] = [[round(row_left + box[0] * scale), round(row_upper + box[1] * scale),
+                                    round(row_left + box[2] * scale), round(row_upper + box[3] * scale)]
+                                   for box in truth['text_boxes']]
+            rows.append(truth)
+        row_upper += row_height
+    return screenshot, {'mode': mode, 'seed': seed, 'menu_box': [left, upper, right, lower], 'rows': rows}
+
+
+def _scale_ground_truth(ground_truth: dict, scale: float) -> dict:
+    ground_truth = dict(ground_truth, menu_box=[round(v * scale) for v in ground_truth['menu_box']])
+    ground_truth['rows'] = [dict(row, box=[round(v * scale) for v in row['box']],
+                                 text_boxes=[[round(v * scale) for v in box] for box in row['text_boxes']])
+                            for row in ground_truth['rows']]
+    return ground_truth
+
+
+def _init_worker(args) -> None:
+    global _args, _sources
+    _args = args
+    _sources = load_sources(args.results_file, args.member_file, args.portrait_db, args.mode)
+
+
+def _generate(job: tuple) -> int:
+    mode, index = job
+    seed = _args.seed + index
+    mode_name = mode.lower().replace(' ', '_')
+    # the same screenshot at every resolution, composed once per aspect ratio
+    screenshots = {}
+    for resolution in _args.resolutions:
+        width, height = parse_resolution(resolution)
+        reference_width = round(width * REFERENCE_HEIGHT / height)
+        if reference_width not in screenshots:
+            screenshots[reference_width] = render_screenshot(mode, _sources, seed, reference_width, _args.font)
+        screenshot, ground_truth = screenshots[reference_width]
+        scale = height / REFERENCE_HEIGHT
+        if scale != 1:
+            screenshot = screenshot.resize((width, height), Image.LANCZOS if scale < 1 else Image.BICUBIC)
+        ground_truth = dict(_scale_ground_truth(ground_truth, scale), resolution=[width, height])
+
+        output_dir = os.path.join(_args.output_dir, resolution)
+        filepath = os.path.join(output_dir, f"{mode_name}_{index:06d}")
+        # fast zlib level, the default one spends most of the run compressing
+        screenshot.save(f"{filepath}.{_args.format}", **({'compress_level': 1} if _args.format == 'png' else {'quality': 95}))
+        with open(f"{filepath}.json", 'w') as f:
+            json.dump(ground_truth, f)
+    return len(ground_truth['rows'])
+
+
+if __name__ == "__main__":
+    args = get_args()
+    for resolution in args.resolutions:
+        os.makedirs(os.path.join(args.output_dir, resolution), exist_ok=True)
+
+    jobs = [(mode, index) for mode in args.mode for index in range(args.num_images)]
+    start = time.perf_counter()
+    with Pool(processes=max(1, args.workers), initializer=_init_worker, initargs=(args,)) as pool:
+        num_rows = sum(pool.imap_unordered(_generate, jobs, chunksize=8))
+    elapsed = time.perf_counter() - start
+    print(f"Wrote {len(jobs) * len(args.resolutions)} screenshots ({num_rows} rows per resolution) "
+          f"to {args.output_dir} in {elapsed:.1f} s")
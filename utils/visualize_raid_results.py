@@ -1,97 +1,212 @@
 import plotly.graph_objs as go
 import plotly.express as px
 import pandas as pd
-from sklearn.linear_model import LinearRegression
+import numpy as np
 import argparse
+import os
 
 def get_args():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--results_file", help="path to the results file", default="../assets/season_7_results.csv")
-    parser.add_argument("--member_file", help="path to the member file", default="../assets/season_7_members.csv")
+    parser.add_argument("--results_file", help="path(s) to the results file(s)", nargs="+", default=["../assets/season_7_results.csv"])
+    parser.add_argument("--member_file", help="path(s) to the member file(s), either one shared file or one per results file",
+                        nargs="+", default=["../assets/season_7_members.csv"])
     parser.add_argument("--chart_studio", help="send the plot to chart studio", action="store_true")
+    parser.add_argument("--report", help="write a self-contained HTML report (WebGL) to this path instead of showing the plots")
+    parser.add_argument("--max_points", help="decimate each boss's scatter to at most this many points in the report", type=int)
+    parser.add_argument("--cache_dir", help="directory for the per-day aggregation cache used by the report", default="../.report_cache")
     parser.add_argument("--chart_studio_username", help="chart studio username", default="")
     parser.add_argument("--chart_studio_api_key", help="chart studio api key", default="")
     args = parser.parse_args()
     return args
 
-if __name__ == "__main__":
-    args = get_args()
-
-    # columns are Boss + lvl, member, damage and K (boolean)
-    df = pd.read_csv(args.results_file)
+def prepare_results(df: pd.DataFrame, df_members: pd.DataFrame) -> pd.DataFrame:
+    """ Vectorized clean up of the raw results (Boss + lvl, Member, Damage, Notes, Day)
+        joined with the members (Member, Synchro LvL). An optional "Source" column on
+        both frames keeps several seasons or alliances apart.
+    """
+    # the string columns only have a handful of distinct values, so parse the categories
+    # once and broadcast the results through the category codes
+    boss = df["Boss"].astype("category")
     # split the boss and level into two columns based on "LvL"
-    df[["Boss", "Level"]] = df["Boss"].str.split("LvL", expand=True)
-    # remove the LvL from the level column
-    df["Level"] = df["Level"].str.replace("LvL", "")
-    # rename the notes column to Kill
-    df = df.rename(columns={"Notes": "Kill"})
-    # set K to true if the member killed the boss
-    df["Kill"] = df["Kill"].apply(lambda x: True if x == "K" else False)
-    # convert the damage to millions
-    df["Damage (M)"] = df["Damage"].apply(lambda x: x / 1000000)
-    # remove the damage column
-    df = df.drop(columns=["Damage"])
-    # convert the day to an integer
-    df["Day"] = df["Day"].apply(lambda x: int(x.replace("Day", "")))
-
-    # columns are Member and Synchro LvL
-    df_members = pd.read_csv(args.member_file)
-    # merge the two dataframes on the Member column
-    df = pd.merge(df, df_members, on="Member")
+    boss_level = boss.cat.categories.to_series().str.extract(r"^(?P<Boss>.*?)\s*LvL\s*(?P<Level>\d+)\s*$")
+    boss_names = pd.Categorical(boss_level["Boss"])
+    boss_levels = pd.to_numeric(boss_level["Level"]).to_numpy(dtype=np.int16)
+    day = df["Day"].astype("category")
+    days = pd.to_numeric(day.cat.categories.to_series().str.extract(r"(\d+)", expand=False)).to_numpy(dtype=np.int16)
+    prepared = pd.DataFrame({
+        "Boss": pd.Categorical.from_codes(boss_names.codes[boss.cat.codes], boss_names.categories),
+        "Level": boss_levels[boss.cat.codes],
+        "Member": df["Member"].astype("category"),
+        # set K to true if the member killed the boss
+        "Kill": df["Notes"].eq("K").to_numpy(),
+        # convert the damage to millions
+        "Damage (M)": df["Damage"].to_numpy(dtype=np.float64) / 1e6,
+        # convert the day to an integer
+        "Day": days[day.cat.codes],
+    })
+    if "Source" in df:
+        prepared["Source"] = df["Source"].astype("category")
+
+    # merge on the Member column (and the Source when the members are per file)
+    merge_on = ["Source", "Member"] if "Source" in df_members else ["Member"]
+    prepared = prepared.merge(df_members, on=merge_on, how="inner")
+    for column in merge_on:
+        prepared[column] = prepared[column].astype("category")
+    return prepared
+
+def source_labels(filepaths: list) -> list:
+    """ A unique label per file: its name without extension, or its relative path where two files
+        share a name, with an index as the last resort.
+    """
+    labels = [os.path.splitext(os.path.basename(filepath))[0] for filepath in filepaths]
+    labels = [os.path.splitext(os.path.relpath(filepath))[0] if labels.count(label) > 1 else label
+              for filepath, label in zip(filepaths, labels)]
+    return [f"{label} ({i + 1})" if labels.count(label) > 1 else label for i, label in enumerate(labels)]
+
+def load_results(results_files: list, member_files: list) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """ Read and prepare any number of results files. Member files are either shared or paired
+        with the results files in order. Returns the prepared results and the members.
+    """
+    if len(member_files) not in (1, len(results_files)):
+        raise ValueError("Pass either one member file or one per results file")
+    sources = source_labels(results_files)
+    df = pd.concat([pd.read_csv(filepath).assign(Source=source) for filepath, source in zip(results_files, sources)],
+                   ignore_index=True)
+    if len(member_files) == 1:
+        df_members = pd.read_csv(member_files[0])
+    else:
+        df_members = pd.concat([pd.read_csv(filepath).assign(Source=source) for filepath, source in zip(member_files, sources)],
+                               ignore_index=True)
+    return prepare_results(df, df_members), df_members
+
+# add member, boss level, synchro lvl, damage, day and kill to the hover text
+# boss is already in the legend and hover text
+# plotly fills the template from customdata in the browser, so no per-point strings are built
+HOVER_COLUMNS = ["Member", "Level", "Synchro LvL", "Damage (M)", "Day", "Kill"]
+HOVER_TEMPLATE = "%{customdata[0]}<br>" + \
+                 "Boss Level: %{customdata[1]}<br>" + \
+                 "Synchro Level: %{customdata[2]}<br>" + \
+                 "Damage: %{customdata[3]}<br>" + \
+                 "Day: %{customdata[4]}<br>" + \
+                 "Kill: %{customdata[5]}"
+
+def with_source(df: pd.DataFrame, columns: list) -> list:
+    """ The group keys for columns, with Source first when several sources are loaded, so
+        seasons or alliances aren't mixed in one trendline or bar.
+    """
+    if "Source" in df and df["Source"].nunique() > 1:
+        return ["Source"] + list(columns)
+    return list(columns)
+
+def member_labels(df: pd.DataFrame) -> pd.Series:
+    # the same member name can appear in several sources, so the bars are labelled with both
+    if "Source" in df and df["Source"].nunique() > 1:
+        return df["Source"].astype(str) + ": " + df["Member"].astype(str)
+    return df["Member"].astype(str)
+
+def member_order(df: pd.DataFrame, df_members: pd.DataFrame) -> np.ndarray:
+    # x axis order of the member bars, by synchro level
+    if "Source" in df and df["Source"].nunique() > 1:
+        # the synchro level of every source's members is in the merged results
+        return member_labels(df.sort_values(by="Synchro LvL")).unique()
+    return df_members.sort_values(by="Synchro LvL")["Member"].unique()
 
+def trendline_sums(df: pd.DataFrame, by: tuple = ("Day",)) -> pd.DataFrame:
+    """ Per-group sums needed for a least-squares fit of damage against synchro level.
+        The sums are additive, so groups can be combined without revisiting the rows.
+    """
+    x = df["Synchro LvL"].to_numpy(dtype=np.float64)
+    y = df["Damage (M)"].to_numpy(dtype=np.float64)
+    by = list(by)
+    columns = {column: df[column].to_numpy() for column in by}
+    grouped = pd.DataFrame({**columns, "n": 1.0, "x": x, "y": y, "xx": x * x, "xy": x * y, "x_min": x, "x_max": x}) \
+        .groupby(by, sort=True, observed=True)
+    return grouped.agg({"n": "sum", "x": "sum", "y": "sum", "xx": "sum", "xy": "sum", "x_min": "min", "x_max": "max"})
+
+def fit_from_sums(sums: pd.DataFrame) -> pd.DataFrame:
+    """ Closed-form least-squares fit for each row of trendline_sums.
+        Returns slope, intercept and the x range of each group.
+    """
+    n = sums["n"]
+    # slope = cov(x, y) / var(x), intercept = mean(y) - slope * mean(x)
+    denominator = n * sums["xx"] - sums["x"] ** 2
+    slope = (n * sums["xy"] - sums["x"] * sums["y"]) / denominator.where(denominator != 0)
+    slope = slope.fillna(0.0)
+    intercept = (sums["y"] - slope * sums["x"]) / n
+    return pd.DataFrame({"slope": slope, "intercept": intercept, "x_min": sums["x_min"], "x_max": sums["x_max"]})
+
+def fit_trendlines(df: pd.DataFrame, by: str = "Day") -> pd.DataFrame:
+    """ Closed-form least-squares fit of damage against synchro level for each group, and
+        each source when several are loaded. Returns slope, intercept and the x range of each group.
+    """
+    return fit_from_sums(trendline_sums(df, with_source(df, [by])))
+
+def damage_vs_level_figure(df: pd.DataFrame, trendlines: pd.DataFrame = None, webgl: bool = False,
+                           max_points: int = None) -> go.Figure:
+    """ Scatter of damage vs synchro level per boss with a trendline per day (and source).
+
+        webgl draws the markers with Scattergl, and max_points decimates each boss's
+        markers to at most that many (the trendlines still use every hit).
+    """
     # plot the damage vs level and color by boss
     fig = go.Figure()
-    for boss in df["Boss"].unique():
-        df_boss = df[df["Boss"] == boss]
-        # add member, boss level, synchro lvl, damage and kill to the hover text
-        # boss is already in the legend and hover text
-        df_boss["hover_text"] = df_boss["Member"] + "<br>" + \
-                                "Boss Level: " + df_boss["Level"].astype(str) + "<br>" + \
-                                "Synchro Level: " + df_boss["Synchro LvL"].astype(str) + "<br>" + \
-                                "Damage: " + df_boss["Damage (M)"].astype(str) + "<br>" + \
-                                "Day: " + df_boss["Day"].astype(str) + "<br>" + \
-                                "Kill: " + df_boss["Kill"].astype(str)
-        fig.add_trace(go.Scatter(x=df_boss["Synchro LvL"], y=df_boss["Damage (M)"], mode="markers", 
-                                 hovertemplate=df_boss["hover_text"], name=boss))
+    scatter = go.Scattergl if webgl else go.Scatter
+    for boss, df_boss in df.groupby("Boss", sort=False, observed=True):
+        if max_points is not None and len(df_boss) > max_points:
+            # keep an evenly strided subset, the rows aren't ordered by level or damage
+            df_boss = df_boss.iloc[::int(np.ceil(len(df_boss) / max_points))]
+        fig.add_trace(scatter(x=df_boss["Synchro LvL"], y=df_boss["Damage (M)"], mode="markers",
+                              customdata=df_boss[HOVER_COLUMNS].to_numpy(), hovertemplate=HOVER_TEMPLATE, name=boss))
 
     trendline_colors = ["red", "blue", "green", "orange", "purple"]
-    for day in df["Day"].unique():
-        df_day = df[df["Day"] == day]
-        # fit a linear regression model
-        model = LinearRegression()
-        model.fit(df_day["Synchro LvL"].values.reshape(-1, 1), df_day["Damage (M)"].values.reshape(-1, 1))
-        # plot the trendline
+    if trendlines is None:
+        trendlines = fit_trendlines(df)
+    for k, (key, slope, intercept, x_min, x_max) in enumerate(zip(trendlines.index, trendlines["slope"], trendlines["intercept"],
+                                                                  trendlines["x_min"], trendlines["x_max"])):
+        # the index is (Source, Day) when several sources are loaded
+        if isinstance(key, tuple):
+            source, day = key
+            name = f"{source} Day {day}"
+        else:
+            day = key
+            name = f"Day {day}"
+        color = trendline_colors[(day - 1) % len(trendline_colors)]
+        # plot the trendline, a straight line only needs its end points
         fig.add_trace(
             go.Scatter(
-                x=df_day["Synchro LvL"],
-                y=model.predict(df_day["Synchro LvL"].values.reshape(-1, 1)).flatten(),
+                x=[x_min, x_max],
+                y=[slope * x_min + intercept, slope * x_max + intercept],
                 mode="lines",
-                name=f"Day {day} Trendline",
+                name=f"{name} Trendline",
                 # make transparent
                 opacity=0.5,
-                line=dict(color=trendline_colors[day - 1], width=2),
+                line=dict(color=color, width=2),
             )
         )
         # plot the equation of the trendline
         fig.add_annotation(
             x=400,
-            y=1300 + (day * 50),
-            text=f"Day {day} Trendline: {model.coef_[0][0]:.2f}x + {model.intercept_[0]:.2f}",
+            y=1300 + ((k + 1) * 50),
+            text=f"{name} Trendline: {slope:.2f}x + {intercept:.2f}",
             showarrow=False,
-            font=dict(size=12, color=trendline_colors[day - 1]),
+            font=dict(size=12, color=color),
         )
     fig.update_layout(title="Damage vs Synchro Level", xaxis_title="Level", yaxis_title="Damage (M)")
-    
+    return fig
+
+def damage_vs_member_figure(df: pd.DataFrame, df_members: pd.DataFrame) -> go.Figure:
     # make a bar chart for each individual member with subbars for each hit against a boss
     # order by the x axis based on the Synchro LvL
-    df_sum = df.groupby('Member')['Damage (M)'].sum().reset_index()
+    order = member_order(df, df_members)
+    # members of different sources get separate bars
+    df = df.assign(Member=member_labels(df))
+    df_sum = df.groupby("Member", observed=True)["Damage (M)"].sum()
     fig2 = px.bar(df, x='Member', y='Damage (M)', color='Boss', orientation='v', color_continuous_scale=px.colors.qualitative.Plotly,
         hover_data={"Boss": True, "Damage (M)": ":.0f", "Level": True, "Kill": True, "Day": True, "Synchro LvL": True, "Member": False})
     # add the df_sum as a annotation on top of each bar
-    total_damage_labels = [f"{row['Damage (M)']:.0f}" for index, row in df_sum.iterrows()]
-    fig2.update_layout(annotations=[go.layout.Annotation(x=member, y=int(label)+100, text=label, showarrow=False) for \
-        member, label in zip(df_sum['Member'], total_damage_labels)])
-    fig2.update_xaxes(categoryorder='array', categoryarray=df_members.sort_values(by="Synchro LvL")["Member"])
+    fig2.update_layout(annotations=[go.layout.Annotation(x=member, y=round(total)+100, text=f"{total:.0f}", showarrow=False) for \
+        member, total in zip(df_sum.index, df_sum.to_numpy())])
+    fig2.update_xaxes(categoryorder='array', categoryarray=order)
     fig2.update_layout(title="Damage vs Member", xaxis_title="Member (Ordered by Synchro Level)", yaxis_title="Damage (M)", legend_title="Boss")
     fig2.update_layout(barmode='stack')
     fig2.update_layout(legend=dict(
@@ -102,15 +217,33 @@ if __name__ == "__main__":
         x=1
     ))
     fig2.update_traces(textposition='outside')
+    return fig2
 
-    if args.chart_studio:
-        import chart_studio
-        chart_studio.tools.set_credentials_file(username=args.chart_studio_username, api_key=args.chart_studio_api_key)
-        chart_studio.tools.set_config_file(world_readable=True, sharing='public')
-        
-        # send the plot to chart studio
-        chart_studio.plotly.plot(fig, filename="Damage vs Synchro Level", auto_open=True)
-        chart_studio.plotly.plot(fig2, filename="Damage vs Member", auto_open=True)
+if __name__ == "__main__":
+    args = get_args()
+
+    # columns are Boss + lvl, member, damage and K (boolean) for the results
+    # and Member and Synchro LvL for the members
+    df, df_members = load_results(args.results_file, args.member_file)
+
+    if args.report:
+        # offline report, aggregates are only recomputed for days whose results changed
+        from raid_report import AggregationCache, write_report
+        aggregates = AggregationCache(args.cache_dir).aggregate(df)
+        write_report(args.report, df, df_members, aggregates, max_points=args.max_points)
+        print(f"Report written to {args.report}")
     else:
-        fig.show()
-        fig2.show()
\ No newline at end of file
+        fig = damage_vs_level_figure(df)
+        fig2 = damage_vs_member_figure(df, df_members)
+
+        if args.chart_studio:
+            import chart_studio
+            chart_studio.tools.set_credentials_file(username=args.chart_studio_username, api_key=args.chart_studio_api_key)
+            chart_studio.tools.set_config_file(world_readable=True, sharing='public')
+
+            # send the plot to chart studio
+            chart_studio.plotly.plot(fig, filename="Damage vs Synchro Level", auto_open=True)
+            chart_studio.plotly.plot(fig2, filename="Damage vs Member", auto_open=True)
+        else:
+            fig.show()
+            fig2.show()